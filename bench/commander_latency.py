@@ -0,0 +1,70 @@
+import argparse
+import statistics
+import threading
+import time
+import typing
+import tasks
+from lib.commander import Commander
+from lib.switchstate import SwitchState
+
+
+class BenchDevice:
+    def __init__(self, device_id):
+        self.id = device_id
+        self.state = SwitchState.NEW
+
+
+class LatencyTask(tasks.DeviceTask):
+    def __init__(self, device, **kwargs):
+        super().__init__(device, **kwargs)
+        self.unique = False
+        self.enqueued_at: float = 0.0
+        self.started_at: typing.Optional[float] = None
+        self.started = threading.Event()
+
+    def validate(self):
+        pass
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        self.started.set()
+
+
+def measure(commander: Commander, devices: int, rounds: int, spacing: float) -> typing.List[float]:
+    latencies = []
+    for _ in range(0, rounds):
+        round_tasks = []
+        for device_id in range(0, devices):
+            task = LatencyTask(BenchDevice(device_id))
+            task.enqueued_at = time.perf_counter()
+            commander.enqueue(task._device, task)
+            round_tasks.append(task)
+        for task in round_tasks:
+            task.started.wait(10)
+            latencies.append(task.started_at - task.enqueued_at)
+        time.sleep(spacing)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='liscain commander enqueue-to-start latency')
+    parser.add_argument('-d', '--devices', type=int, default=50, help='devices enqueued per round')
+    parser.add_argument('-r', '--rounds', type=int, default=20, help='number of rounds')
+    parser.add_argument('-s', '--spacing', type=float, default=0.05, help='idle time between rounds (seconds)')
+    parser.add_argument('-p', '--pool-size', type=int, default=0, help='commander pool size (0 = thread per device)')
+    args = parser.parse_args()
+
+    commander = Commander(args.pool_size) if args.pool_size > 0 else Commander()
+    commander.start()
+    try:
+        latencies = sorted(measure(commander, args.devices, args.rounds, args.spacing))
+    finally:
+        commander.stop()
+    print('tasks: {}'.format(len(latencies)))
+    print('p50:   {:.3f} ms'.format(statistics.median(latencies) * 1000))
+    print('p99:   {:.3f} ms'.format(latencies[int(len(latencies) * 0.99) - 1] * 1000))
+    print('max:   {:.3f} ms'.format(latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import logging
+import re
+import threading
+import time
+import typing
+
+
+RE_WHITESPACE = re.compile(r'\s')
+RE_LINE_END = re.compile(b'[\r\n]')
+RE_TCL_WRITE = re.compile(r'^(?:set (\w+) \[open "([^"]+)" w\+?\]; puts \$\1|puts \[open "([^"]+)" w\+?\]) \{$')
+RE_TCL_READ = re.compile(r'^set \w+ \[open "([^"]+)" r\]')
+RE_TCL_CLOSE = re.compile(r'\bclose \$(\w+)')
+
+
+class LineReader:
+    def __init__(self, reader: asyncio.StreamReader):
+        self._reader = reader
+        self._buffer = bytearray()
+
+    async def readline(self) -> typing.Optional[str]:
+        # commands end with '\n', tclsh input with '\r'
+        while True:
+            match = RE_LINE_END.search(self._buffer)
+            if match is not None:
+                line = bytes(self._buffer[:match.start()])
+                del self._buffer[:match.end()]
+                return line.decode('ascii', 'replace')
+            data = await self._reader.read(4096)
+            if len(data) == 0:
+                return None
+            self._buffer += data
+
+
+class SwitchProfile:
+    def __init__(self, keygen_delay: float = 1.0, copy_delay: float = 0.5, command_delay: float = 0.0,
+                 pid: str = 'WS-C2960X-48FPD-L', version: str = '15.2(7)E4'):
+        self.keygen_delay = keygen_delay
+        self.copy_delay = copy_delay
+        self.command_delay = command_delay
+        self.pid = pid
+        self.version = version
+
+
+class SimulatedSwitch:
+    def __init__(self, index: int, port: int, hostname: str, profile: SwitchProfile):
+        self.index = index
+        self.port = port
+        self.hostname = hostname
+        self.profile = profile
+        self.mac_address = '02:00:{:02x}:{:02x}:{:02x}:{:02x}'.format(
+            index >> 24 & 0xff, index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff
+        )
+        self.flash: typing.Dict[str, str] = dict()
+        self.startup_config: typing.Optional[str] = None
+        self.sessions = 0
+        self.reloads = 0
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+
+    @property
+    def address(self) -> str:
+        return '127.0.0.1:{}'.format(self.port)
+
+    def _ios_mac(self) -> str:
+        mac = self.mac_address.replace(':', '')
+        return '{}.{}.{}'.format(mac[0:4], mac[4:8], mac[8:12])
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, '127.0.0.1', self.port)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.sessions += 1
+        try:
+            await self._dialogue(LineReader(reader), writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dialogue(self, reader: LineReader, writer: asyncio.StreamWriter):
+        writer.write(b'\r\n\r\nUser Access Verification\r\n\r\nUsername: ')
+        if await reader.readline() is None:
+            return
+        writer.write(b'\r\nPassword: ')
+        if await reader.readline() is None:
+            return
+        mode = ''
+        # like tcl, written text stays in the channel buffer and only lands in flash once the channel is closed
+        channels: typing.Dict[str, typing.Tuple[str, str]] = dict()
+        writer.write('\r\n{}#'.format(self.hostname).encode('ascii'))
+        while True:
+            line = await reader.readline()
+            if line is None:
+                return
+            command = line.strip()
+            if self.profile.command_delay > 0:
+                await asyncio.sleep(self.profile.command_delay)
+            output = ''
+            write_match = RE_TCL_WRITE.match(command) if mode == '(tcl)' else None
+            read_match = RE_TCL_READ.match(command) if mode == '(tcl)' else None
+            if write_match is not None:
+                channel = write_match.group(1) or 'file{}'.format(len(channels))
+                text, tail = await self._tclsh_upload(reader, writer, line)
+                channels[channel] = (write_match.group(2) or write_match.group(3), text)
+                for closed in RE_TCL_CLOSE.findall(tail):
+                    self._close_channel(channels, closed)
+                writer.write('\r\n{}(tcl)#'.format(self.hostname).encode('ascii'))
+                continue
+            elif read_match is not None:
+                output = '{}\r\n'.format(len(RE_WHITESPACE.sub('', self.flash.get(read_match.group(1), ''))))
+            elif mode == '(tcl)' and command.startswith('close $'):
+                for closed in RE_TCL_CLOSE.findall(command):
+                    self._close_channel(channels, closed)
+            elif command == 'exit':
+                if mode == '':
+                    writer.write(b'exit\r\n')
+                    return
+                if mode == '(tcl)':
+                    # leaving tclsh closes whatever channels are still open
+                    for closed in list(channels):
+                        self._close_channel(channels, closed)
+                mode = ''
+            elif command == 'end':
+                mode = ''
+            elif command == 'configure terminal':
+                output = 'Enter configuration commands, one per line.  End with CNTL/Z.\r\n'
+                mode = '(config)'
+            elif command == 'tclsh':
+                mode = '(tcl)'
+            elif command.startswith('hostname '):
+                self.hostname = command.split()[1]
+            elif command == 'show interface vlan1':
+                output = 'Vlan1 is up, line protocol is up\r\n  Hardware is EtherSVI, address is {0} (bia {0})\r\n'.format(
+                    self._ios_mac()
+                )
+            elif command == 'show inventory':
+                output = 'NAME: "1", DESCR: "{0}"\r\nPID: {0}  , VID: V05  , SN: SIM{1:08d}\r\n'.format(
+                    self.profile.pid, self.index
+                )
+            elif command == 'show version':
+                output = 'Cisco IOS Software, C2960X Software (C2960X-UNIVERSALK9-M), Version {}, RELEASE SOFTWARE (fc1)\r\n'.format(
+                    self.profile.version
+                )
+            elif command.startswith('show cdp neigh'):
+                output = 'Device ID        Local Intrfce     Holdtme    Capability  Platform  Port ID\r\n' \
+                         'sim-upstream     Gig 1/0/1         150             S I  WS-C3850  Gig 1/0/{}\r\n'.format(self.index + 1)
+            elif command.startswith('crypto key generate rsa'):
+                await asyncio.sleep(self.profile.keygen_delay)
+                output = '% Generating 2048 bit RSA keys, keys will be non-exportable...\r\n' \
+                         '[OK] (elapsed time was {} seconds)\r\n'.format(int(self.profile.keygen_delay))
+            elif command == 'write':
+                output = 'Building configuration...\r\n[OK]\r\n'
+            elif command.startswith('copy ') and command.endswith(' startup-config'):
+                await self._copy(reader, writer, command.split()[1])
+                continue
+            elif command == 'reload':
+                writer.write(b'reload\r\nProceed with reload? [confirm]')
+                await reader.readline()
+                self.reloads += 1
+                return
+            writer.write('{}\r\n{}{}{}#'.format(line, output, self.hostname, mode).encode('ascii'))
+
+    def _close_channel(self, channels: typing.Dict[str, typing.Tuple[str, str]], channel: str):
+        if channel in channels:
+            name, text = channels.pop(channel)
+            self.flash[name] = text
+
+    async def _tclsh_upload(self, reader: LineReader, writer: asyncio.StreamWriter,
+                            first_line: str) -> typing.Tuple[str, str]:
+        writer.write('{}\r\n+>'.format(first_line).encode('ascii'))
+        lines = []
+        while True:
+            line = await reader.readline()
+            if line is None:
+                raise ConnectionError('closed during tclsh upload')
+            if line.strip().startswith('}'):
+                writer.write(line.strip().encode('ascii'))
+                return '\n'.join(lines), line.strip()[1:]
+            lines.append(line)
+            writer.write('{}\r\n+>'.format(line).encode('ascii'))
+
+    async def _copy(self, reader: LineReader, writer: asyncio.StreamWriter, source: str):
+        writer.write('copy {} startup-config\r\nDestination filename [startup-config]? '.format(source).encode('ascii'))
+        if await reader.readline() is None:
+            return
+        await asyncio.sleep(self.profile.copy_delay)
+        if source.startswith('flash:'):
+            self.startup_config = self.flash.get(source, '')
+        else:
+            # remote sources are not fetched, the simulator only models the transfer time
+            self.startup_config = source
+        writer.write('\r\n[OK - {} bytes]\r\n\r\n{} bytes copied in {:.3f} secs\r\n{}#'.format(
+            len(self.startup_config), len(self.startup_config), self.profile.copy_delay, self.hostname
+        ).encode('ascii'))
+
+
+class SimulatedFleet:
+    def __init__(self, count: int, base_port: int = 20000, hostname_prefix: str = 'lc-sim-',
+                 profile: typing.Optional[SwitchProfile] = None):
+        self._logger = logging.getLogger('ios-simulator')
+        profile = profile if profile is not None else SwitchProfile()
+        self.switches = [
+            SimulatedSwitch(index, base_port + index, '{}{:05d}'.format(hostname_prefix, index), profile)
+            for index in range(0, count)
+        ]
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def start(self):
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(asyncio.gather(*[switch.start() for switch in self.switches]))
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='ios-simulator', daemon=True)
+        self._thread.start()
+        started.wait()
+        self._logger.info(
+            'simulating %s switches on 127.0.0.1:%s-%s',
+            len(self.switches), self.switches[0].port, self.switches[-1].port
+        )
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        def shutdown():
+            for switch in self.switches:
+                switch.stop()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(shutdown)
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulated cisco ios switches for liscain')
+    parser.add_argument('-n', '--switches', type=int, default=10, help='number of switches')
+    parser.add_argument('-p', '--base-port', type=int, default=20000, help='telnet port of the first switch')
+    parser.add_argument('-k', '--keygen-delay', type=float, default=1.0, help='seconds spent in crypto key generate')
+    parser.add_argument('-c', '--copy-delay', type=float, default=0.5, help='seconds spent copying to startup-config')
+    parser.add_argument('-d', '--command-delay', type=float, default=0.0, help='seconds before answering any command')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)-15s %(levelname)-8s %(name)-16s %(message)s')
+    fleet = SimulatedFleet(
+        args.switches,
+        args.base_port,
+        profile=SwitchProfile(args.keygen_delay, args.copy_delay, args.command_delay),
+    )
+    fleet.start()
+    for switch in fleet.switches:
+        print('{} {} {}'.format(switch.hostname, switch.address, switch.mac_address))
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        fleet.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+import requests
+from lib.jaspy import JaspyClient
+
+
+class JaspyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0.02
+    ports = 48
+    requests_served = 0
+    connections = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        fqdn = urllib.parse.parse_qs(url.query).get('device_fqdn', [''])[0]
+        with JaspyHandler.lock:
+            JaspyHandler.requests_served += 1
+            JaspyHandler.connections.add(self.client_address)
+        time.sleep(self.delay)
+        body = json.dumps([
+            {
+                'name': 'GigabitEthernet1/0/{}'.format(port),
+                'description': 'Gi1/0/{}'.format(port),
+                'alias': 'uplink liscain:{}-{}'.format(fqdn.split('.')[0], port),
+            }
+            for port in range(1, self.ports + 1)
+        ]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(delay: float) -> str:
+    JaspyHandler.delay = delay
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), JaspyHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def legacy_lookup(api: str, neighbors):
+    results = set()
+    for remote_device, remote_interface in neighbors:
+        for device_interface in requests.get('{}/interface'.format(api), params={'device_fqdn': remote_device}).json():
+            if remote_interface == device_interface['name']:
+                results.add(device_interface['alias'].split(':', 1)[1])
+                break
+    return results
+
+
+def client_lookup(client: JaspyClient, neighbors):
+    interfaces = client.interfaces_many(remote_device for remote_device, _ in neighbors)
+    results = set()
+    for remote_device, remote_interface in neighbors:
+        for device_interface in interfaces[remote_device]:
+            if remote_interface == device_interface['name']:
+                results.add(device_interface['alias'].split(':', 1)[1])
+                break
+    return results
+
+
+def reset_counters():
+    with JaspyHandler.lock:
+        JaspyHandler.requests_served = 0
+        JaspyHandler.connections = set()
+
+
+def expected_interfaces(fqdn: str):
+    return [
+        {
+            'name': 'GigabitEthernet1/0/{}'.format(port),
+            'description': 'Gi1/0/{}'.format(port),
+            'alias': 'uplink liscain:{}-{}'.format(fqdn.split('.')[0], port),
+        }
+        for port in range(1, JaspyHandler.ports + 1)
+    ]
+
+
+def check(api: str, workload) -> typing.List[str]:
+    failures = []
+
+    def expect(condition: bool, message: str):
+        print('{:<4} {}'.format('ok' if condition else 'FAIL', message))
+        if not condition:
+            failures.append(message)
+
+    client = JaspyClient(api)
+    expect(client.interfaces('a.example.com') == expected_interfaces('a.example.com'), 'interface list matches jaspy')
+    expect(
+        all(client_lookup(client, neighbors) == legacy_lookup(api, neighbors) for neighbors in workload),
+        'client lookups resolve the same identities as the legacy lookup'
+    )
+
+    reset_counters()
+    results = []
+    barrier = threading.Barrier(8)
+
+    def lookup():
+        barrier.wait()
+        results.append(client.interfaces('coalesce.example.com'))
+
+    threads = [threading.Thread(target=lookup) for _ in range(0, 8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expect(JaspyHandler.requests_served == 1, '8 concurrent identical lookups coalesce into {} request(s)'.format(
+        JaspyHandler.requests_served
+    ))
+    expect(
+        len(results) == 8 and all(result == expected_interfaces('coalesce.example.com') for result in results),
+        'every coalesced lookup gets the interface list'
+    )
+
+    reset_counters()
+    many = client.interfaces_many(['b.example.com', 'c.example.com', 'b.example.com'])
+    expect(JaspyHandler.requests_served == 2, 'interfaces_many fetches each distinct switch once')
+    expect(
+        many == {fqdn: expected_interfaces(fqdn) for fqdn in ('b.example.com', 'c.example.com')},
+        'interfaces_many returns a list per switch'
+    )
+
+    client = JaspyClient(api, ttl=0.5)
+    reset_counters()
+    for index in range(0, 5):
+        client.interfaces('pool{}.example.com'.format(index))
+    expect(len(JaspyHandler.connections) == 1, 'sequential lookups reuse {} connection(s)'.format(
+        len(JaspyHandler.connections)
+    ))
+
+    reset_counters()
+    client.interfaces('pool0.example.com')
+    expect(JaspyHandler.requests_served == 0, 'lookups within the ttl are answered from the cache')
+    time.sleep(0.6)
+    client.interfaces('pool0.example.com')
+    expect(JaspyHandler.requests_served == 1, 'lookups after the ttl go to jaspy again')
+    client.invalidate('pool0.example.com')
+    client.interfaces('pool0.example.com')
+    expect(JaspyHandler.requests_served == 2, 'invalidated switches go to jaspy again')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='liscain jaspy lookup latency')
+    parser.add_argument('-s', '--switches', type=int, default=100, help='switches to resolve')
+    parser.add_argument('-n', '--neighbors', type=int, default=2, help='cdp neighbors per switch')
+    parser.add_argument('-u', '--upstreams', type=int, default=10, help='distinct upstream switches')
+    parser.add_argument('-d', '--delay', type=float, default=0.02, help='jaspy response time in seconds')
+    parser.add_argument('-t', '--ttl', type=float, default=300, help='interface list cache ttl')
+    parser.add_argument('-c', '--check', default=False, action='store_true',
+                        help='check client results, coalescing, pooling and expiry instead of timing')
+    args = parser.parse_args()
+
+    # the check needs lookups to overlap, give concurrent requests time to pile up
+    api = start_server(max(args.delay, 0.1) if args.check else args.delay)
+    rng = random.Random(0)
+    workload = [
+        [
+            ('upstream{}.example.com'.format(rng.randrange(args.upstreams)), 'GigabitEthernet1/0/{}'.format(rng.randint(1, 48)))
+            for _ in range(0, args.neighbors)
+        ]
+        for _ in range(0, args.switches)
+    ]
+
+    if args.check:
+        if len(check(api, workload[:10])) > 0:
+            sys.exit(1)
+        return
+
+    client = JaspyClient(api, ttl=args.ttl)
+    for name, lookup in (('legacy', lambda neighbors: legacy_lookup(api, neighbors)),
+                         ('client', lambda neighbors: client_lookup(client, neighbors))):
+        JaspyHandler.requests_served = 0
+        durations = []
+        started = time.perf_counter()
+        for neighbors in workload:
+            switch_started = time.perf_counter()
+            lookup(neighbors)
+            durations.append(time.perf_counter() - switch_started)
+        elapsed = time.perf_counter() - started
+        durations.sort()
+        print('{}: {} switches in {:.3f} s, {} jaspy requests, p50 {:.1f} ms, max {:.1f} ms'.format(
+            name, len(workload), elapsed, JaspyHandler.requests_served,
+            durations[len(durations) // 2] * 1000, durations[-1] * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from enum import Enum as PyEnum
+import lib.db
+import lib.wire
+from devices.ciscoios import CiscoIOS
+from devices.device import Device
+from lib.switchstate import SwitchState
+
+
+def reflective_as_dict(device):
+    ret = {}
+    for col in device.__table__.columns:
+        val = getattr(device, col.name)
+        if isinstance(val, str):
+            ret[col.name] = val
+        elif isinstance(val, int):
+            ret[col.name] = val
+        elif isinstance(val, float):
+            ret[col.name] = val
+        elif isinstance(val, PyEnum):
+            ret[col.name] = str(val)
+    return ret
+
+
+def populate(count: int):
+    states = list(SwitchState)
+    with lib.db.sql_ses() as ses:
+        for index in range(0, count):
+            device = CiscoIOS()
+            device.initialize('switch-{:05d}'.format(index), '10.{}.{}.{}'.format(index // 65536, index // 256 % 256, index % 256))
+            device.mac_address = '00:11:22:{:02x}:{:02x}:{:02x}'.format(index // 65536, index // 256 % 256, index % 256)
+            device.device_type = 'WS-C2960X-48FPD-L'
+            device.version = '15.2(7)E4'
+            device.state = states[index % len(states)]
+            ses.add(device)
+        ses.commit()
+
+
+def listing_orm(serialize):
+    with lib.db.sql_ses() as ses:
+        return [dict(serialize(device), cqueue=0) for device in ses.query(Device).all()]
+
+
+def listing_columns():
+    columns = list(Device.__table__.columns)
+    ret = []
+    with lib.db.sql_ses() as ses:
+        for row in ses.query(*columns).order_by(Device.id):
+            device_dict = {}
+            for column, val in zip(columns, row):
+                if isinstance(val, SwitchState):
+                    device_dict[column.name] = str(val)
+                elif val is not None:
+                    device_dict[column.name] = val
+            device_dict['cqueue'] = 0
+            ret.append(device_dict)
+    return ret
+
+
+def measure(name: str, build, encoding: str, rounds: int):
+    build_times, encode_times, decode_times = [], [], []
+    size = 0
+    for _ in range(0, rounds):
+        started = time.perf_counter()
+        listing = build()
+        built = time.perf_counter()
+        payload = lib.wire.encode(listing, encoding)
+        encoded = time.perf_counter()
+        lib.wire.decode(payload)
+        decoded = time.perf_counter()
+        build_times.append(built - started)
+        encode_times.append(encoded - built)
+        decode_times.append(decoded - encoded)
+        size = len(payload)
+    build_ms = statistics.median(build_times) * 1000
+    encode_ms = statistics.median(encode_times) * 1000
+    decode_ms = statistics.median(decode_times) * 1000
+    print('{:<32} rows {:7.1f} ms  encode {:6.1f} ms  decode {:6.1f} ms  total {:7.1f} ms  {:8d} bytes'.format(
+        name, build_ms, encode_ms, decode_ms, build_ms + encode_ms + decode_ms, size
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='liscain list reply encoding')
+    parser.add_argument('-n', '--devices', type=int, default=10000)
+    parser.add_argument('-r', '--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as td:
+        lib.db.initialize('sqlite:///{}'.format(os.path.join(td, 'bench.sqlite')))
+        populate(args.devices)
+        cases = [
+            ('orm + reflective as_dict, json', lambda: listing_orm(reflective_as_dict), lib.wire.JSON),
+            ('orm + row serializer, json', lambda: listing_orm(lib.db.as_dict), lib.wire.JSON),
+            ('column query, json', listing_columns, lib.wire.JSON),
+        ]
+        if lib.wire.MSGPACK in lib.wire.encodings():
+            cases += [
+                ('orm + row serializer, msgpack', lambda: listing_orm(lib.db.as_dict), lib.wire.MSGPACK),
+                ('column query, msgpack', listing_columns, lib.wire.MSGPACK),
+            ]
+        print('{} devices, median of {} rounds'.format(args.devices, args.rounds))
+        for name, build, encoding in cases:
+            measure(name, build, encoding, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import ipaddress
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import timeit
+import typing
+import lib.db
+import lib.cdp_adopter
+import lib.config_repository
+import liscain
+from devices.ciscoios import CiscoIOS
+from lib.switchstate import SwitchState
+from lib.temp_storage import TempStorage
+
+
+BASELINE_VERSION = 1
+LIST_SIZES = (100, 1000, 10000)
+CONTENTION_THREADS = 8
+CONTENTION_OPS = 500
+
+
+class IdleCommander:
+    # the benchmarks time request handling, enqueued tasks are dropped instead of telnetting to made up addresses
+    def enqueue(self, device, task):
+        pass
+
+    def queue_lengths(self) -> typing.Dict[int, int]:
+        return {}
+
+
+class Case:
+    def __init__(self, name: str, func: typing.Callable[[], typing.Any], ops: int = 1):
+        self.name = name
+        self.func = func
+        self.ops = ops
+
+
+def populate(count: int, prefix: str = 'switch'):
+    states = list(SwitchState)
+    with lib.db.sql_ses() as ses:
+        for index in range(0, count):
+            device = CiscoIOS()
+            device.initialize(
+                '{}-{:05d}'.format(prefix, index),
+                '10.{}.{}.{}'.format(index // 65536, index // 256 % 256, index % 256)
+            )
+            device.mac_address = '00:11:22:{:02x}:{:02x}:{:02x}'.format(index // 65536, index // 256 % 256, index % 256)
+            device.device_type = 'WS-C2960X-48FPD-L'
+            device.version = '15.2(7)E4'
+            device.state = states[index % len(states)]
+            ses.add(device)
+        ses.commit()
+
+
+def large_switch_config(lines: int = 5000) -> str:
+    out = [
+        '! liscain::device_type WS-C2960X',
+        '! liscain::uplink Gi1/0/52',
+        'hostname bench',
+    ]
+    port = 1
+    while len(out) < lines:
+        out += [
+            'interface GigabitEthernet1/0/{}'.format(port),
+            ' description access port {}'.format(port),
+            ' switchport access vlan {}'.format(100 + port % 20),
+            ' switchport mode access',
+            '!',
+        ]
+        port += 1
+    return '\n'.join(out[:lines]) + '\nend\n'
+
+
+def cdp_detail(neighbors: int = 48) -> str:
+    out = []
+    for index in range(0, neighbors):
+        out.append(
+            '-------------------------\n'
+            'Device ID: dist-{0:02d}.example.com\n'
+            'Entry address(es): \n'
+            '  IP address: 10.0.0.{0}\n'
+            'Platform: cisco WS-C3850-48P,  Capabilities: Switch IGMP \n'
+            'Interface: GigabitEthernet1/0/{1},  Port ID (outgoing port): GigabitEthernet2/0/{0}\n'
+            'Holdtime : 131 sec\n\n'
+            'Version :\n'
+            'Cisco IOS Software, IOS-XE Software, Catalyst L3 Switch Software, Version 16.9.5\n'.format(index, index + 1)
+        )
+    return ''.join(out)
+
+
+def contended(temp_storage: TempStorage, payload: str):
+    barrier = threading.Barrier(CONTENTION_THREADS)
+
+    def worker():
+        barrier.wait()
+        for _ in range(0, CONTENTION_OPS):
+            temp_storage.get(temp_storage.store(payload))
+
+    threads = [threading.Thread(target=worker) for _ in range(0, CONTENTION_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def cases(td: str) -> typing.Iterator[Case]:
+    # each case is measured as it is yielded, before the next one switches the database underneath it
+    for size in LIST_SIZES:
+        lib.db.initialize('sqlite:///{}'.format(os.path.join(td, 'list-{}.sqlite'.format(size))))
+        populate(size)
+        message = {'cmd': 'list'}
+        yield Case('handle_msg list {} devices'.format(size), lambda: liscain.handle_msg(message))
+
+    lib.db.initialize('sqlite:///{}'.format(os.path.join(td, 'micro.sqlite')))
+    populate(1000, prefix='lc')
+    with lib.db.sql_ses() as ses:
+        device = ses.query(CiscoIOS).order_by(CiscoIOS.id).first()
+        ses.expunge(device)
+    yield Case('Device.as_dict', device.as_dict)
+
+    new_addresses = (
+        '172.{}.{}.{}'.format(16 + index // 65536, index // 256 % 256, index % 256) for index in range(0, 1 << 20)
+    )
+    yield Case('serve_file new device', lambda: liscain.serve_file('network-confg', raddress=next(new_addresses)))
+    remote_id = 'lc-{:02x}'.format(int(ipaddress.ip_address(device.address)))
+    with lib.db.sql_ses() as ses:
+        ses.query(CiscoIOS).filter(CiscoIOS.id == device.id).update({'identifier': remote_id, 'state': SwitchState.READY})
+        ses.commit()
+    liscain.serve_file('network-confg', raddress=device.address)
+    yield Case('serve_file known device (coalesced)', lambda: liscain.serve_file('network-confg', raddress=device.address))
+    yield Case('boot_config known device', lambda: liscain.boot_config(device.address, remote_id))
+
+    switch_config = large_switch_config()
+    yield Case('parse_confighints 5000 lines', lambda: lib.config_repository.parse_confighints(switch_config))
+
+    cdp_info = cdp_detail()
+    yield Case('parse_cdp_neighbors 48 neighbors', lambda: lib.cdp_adopter.parse_cdp_neighbors(cdp_info))
+
+    option82 = liscain.option82_controller
+    for port in range(0, 64):
+        option82.set_association('02:ff:00:00:00:01', 'gi1/0/{}'.format(port), 'bench-{}'.format(port))
+    renewals = [
+        ('02:ff:00:00:00:01', 'gi1/0/{}'.format(port), '02:00:00:00:00:{:02x}'.format(port)) for port in range(0, 64)
+    ]
+    option82.apply_batch(renewals)
+    yield Case('Option82.update_info renewal', lambda: option82.update_info(*renewals[0]))
+    flips = iter(range(0, 1 << 30))
+    yield Case(
+        'Option82.update_info change',
+        lambda: option82.update_info('02:ff:00:00:00:01', 'gi1/0/1', '02:00:01:00:00:{:02x}'.format(next(flips) % 2))
+    )
+
+    temp_storage = TempStorage(ttl=3600, max_bytes=64 * 1024 * 1024, one_shot=True)
+    payload = large_switch_config(400)
+    yield Case(
+        'TempStorage store+get {} threads'.format(CONTENTION_THREADS),
+        lambda: contended(temp_storage, payload),
+        ops=CONTENTION_THREADS * CONTENTION_OPS,
+    )
+
+
+def measure(case: Case, repeat: int, min_time: float) -> float:
+    timer = timeit.Timer(case.func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number / case.ops
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return '{:9.3f} ms'.format(seconds * 1e3)
+    return '{:9.3f} µs'.format(seconds * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='liscain hot path micro benchmarks')
+    parser.add_argument('-k', '--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timing repeats, the fastest is kept')
+    parser.add_argument('-m', '--min-time', type=float, default=0.2, help='minimum seconds per repeat')
+    parser.add_argument('-s', '--save', default=None, help='write results to this baseline file')
+    parser.add_argument('-b', '--baseline', default=None, help='compare against this baseline file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.25,
+                        help='fail when a benchmark is this fraction slower than the baseline')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline.get('version') != BASELINE_VERSION:
+            print('{}: unsupported baseline version {}'.format(args.baseline, baseline.get('version')))
+            sys.exit(2)
+        baseline = baseline['results']
+
+    liscain.commander.stop()
+    liscain.commander = IdleCommander()
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as td:
+        for case in cases(td):
+            if args.filter is not None and args.filter not in case.name:
+                continue
+            per_op = measure(case, args.repeat, args.min_time)
+            results[case.name] = per_op
+            line = '{:<40} {}'.format(case.name, format_time(per_op))
+            if baseline is not None and case.name in baseline:
+                ratio = per_op / baseline[case.name]
+                line += '  {:6.2f}x baseline'.format(ratio)
+                if ratio > 1 + args.threshold:
+                    line += '  REGRESSION'
+                    regressions.append(case.name)
+            print(line, flush=True)
+
+    if args.save is not None:
+        with open(args.save, 'w') as fp:
+            json.dump({
+                'version': BASELINE_VERSION,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+    if len(regressions) > 0:
+        print('{} benchmark(s) regressed more than {:.0%}: {}'.format(
+            len(regressions), args.threshold, ', '.join(regressions)
+        ))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+import typing
+import lib.db
+import tasks
+from bench.ios_simulator import SimulatedFleet, SwitchProfile
+from devices.ciscoios import CiscoIOS
+from lib.commander import Commander
+from lib.config_repository import ConfigRepository, CONFIG_SUFFIX
+from lib.option82 import Option82
+from lib.switchstate import SwitchState
+from lib.temp_storage import TempStorage
+
+
+UPSTREAM_SWITCH_MAC = '02:ff:00:00:00:01'
+FINAL_STATES = (SwitchState.CONFIGURED, SwitchState.INIT_FAILED, SwitchState.CONFIGURE_FAILED)
+
+
+def switch_config(name: str, lines: int) -> str:
+    out = ['hostname {}'.format(name), '!']
+    port = 1
+    while len(out) < lines:
+        out += [
+            'interface GigabitEthernet1/0/{}'.format(port),
+            ' description access port {}'.format(port),
+            ' switchport access vlan {}'.format(100 + port % 20),
+            ' switchport mode access',
+            ' spanning-tree portfast',
+            '!',
+        ]
+        port += 1
+    return '\n'.join(out[:lines]) + '\nend\n'
+
+
+def prepare(td: str, fleet: SimulatedFleet, config_lines: int, option82: Option82) -> typing.List[CiscoIOS]:
+    for switch in fleet.switches:
+        name = 'sim-{:05d}'.format(switch.index)
+        with open(os.path.join(td, 'config', '{}{}'.format(name, CONFIG_SUFFIX)), 'w') as fp:
+            fp.write(switch_config(name, config_lines))
+        upstream_port = 'gi1/0/{}'.format(switch.index + 1)
+        option82.set_association(UPSTREAM_SWITCH_MAC, upstream_port, name)
+        option82.apply_batch([(UPSTREAM_SWITCH_MAC, upstream_port, switch.mac_address)])
+    devices = []
+    with lib.db.sql_ses() as ses:
+        for switch in fleet.switches:
+            device = CiscoIOS()
+            device.initialize(switch.hostname, switch.address)
+            ses.add(device)
+            devices.append(device)
+        ses.commit()
+        for device in devices:
+            ses.refresh(device)
+        ses.expunge_all()
+    return devices
+
+
+def init_task(device: CiscoIOS, option82: Option82, temp_storage: TempStorage, single_session: bool):
+    if single_session:
+        return tasks.DeviceInitializationTask(device, adopter=option82, temp_storage=temp_storage)
+    task = tasks.DeviceInitializationTask(device)
+    task.hook(SwitchState.READY, option82.autoadopt)
+    return task
+
+
+def provision(commander: Commander, devices: typing.List[CiscoIOS], option82: Option82, temp_storage: TempStorage,
+              single_session: bool, timeout: float) -> typing.Tuple[float, typing.Dict[int, float]]:
+    started = time.perf_counter()
+    for device in devices:
+        commander.enqueue(device, init_task(device, option82, temp_storage, single_session))
+    # devices are polled rather than hooked so both the single session and the separate task path are timed the same
+    finished: typing.Dict[int, float] = dict()
+    deadline = started + timeout
+    while len(finished) < len(devices) and time.perf_counter() < deadline:
+        now = time.perf_counter()
+        for device in devices:
+            if device.id not in finished and device.state in FINAL_STATES:
+                finished[device.id] = now - started
+        time.sleep(0.005)
+    return time.perf_counter() - started, finished
+
+
+def percentile(values: typing.List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, max(0, int(round(len(values) * fraction)) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='liscain end to end provisioning against simulated switches')
+    parser.add_argument('-n', '--switches', type=int, default=50, help='number of simulated switches')
+    parser.add_argument('-p', '--base-port', type=int, default=20000, help='telnet port of the first switch')
+    parser.add_argument('-P', '--pool-size', type=int, default=0, help='commander pool size (0 = thread per device)')
+    parser.add_argument('-s', '--separate-tasks', default=False, action='store_true',
+                        help='configure in a separate task after READY instead of a single session')
+    parser.add_argument('-l', '--config-lines', type=int, default=400, help='lines in each switch config')
+    parser.add_argument('-k', '--keygen-delay', type=float, default=1.0, help='seconds spent in crypto key generate')
+    parser.add_argument('-c', '--copy-delay', type=float, default=0.5, help='seconds spent copying to startup-config')
+    parser.add_argument('-d', '--command-delay', type=float, default=0.0, help='seconds before answering any command')
+    parser.add_argument('-t', '--timeout', type=float, default=600, help='give up after this many seconds')
+    parser.add_argument('-v', '--verbose', default=False, action='store_true', help='log liscain output')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)-15s %(levelname)-8s %(name)-16s %(message)s'
+    )
+    fleet = SimulatedFleet(
+        args.switches,
+        args.base_port,
+        profile=SwitchProfile(args.keygen_delay, args.copy_delay, args.command_delay),
+    )
+    with tempfile.TemporaryDirectory() as td:
+        os.mkdir(os.path.join(td, 'config'))
+        lib.db.initialize('sqlite:///{}'.format(os.path.join(td, 'bench.sqlite')))
+        fleet.start()
+        commander = Commander(args.pool_size)
+        commander.start()
+        try:
+            temp_storage = TempStorage()
+            config_repository = ConfigRepository(os.path.join(td, 'config'))
+            option82 = Option82(commander, temp_storage, config_repository)
+            devices = prepare(td, fleet, args.config_lines, option82)
+            config_repository.load()
+            elapsed, finished = provision(
+                commander, devices, option82, temp_storage, not args.separate_tasks, args.timeout
+            )
+        finally:
+            # running tasks still save to the database, let them finish before it is removed
+            commander.stop()
+            fleet.stop()
+
+    states: typing.Dict[str, int] = dict()
+    for device in devices:
+        states[str(device.state)] = states.get(str(device.state), 0) + 1
+    configured = sorted(
+        finished[device.id] for device in devices if device.id in finished and device.state == SwitchState.CONFIGURED
+    )
+    print('{} switches, {}, {}'.format(
+        len(devices),
+        'pool of {} workers'.format(args.pool_size) if args.pool_size > 0 else 'thread per device',
+        'separate tasks' if args.separate_tasks else 'single session',
+    ))
+    print('states:     {}'.format(', '.join('{} {}'.format(state, count) for state, count in sorted(states.items()))))
+    print('wall time:  {:.2f} s'.format(elapsed))
+    if len(configured) == 0:
+        return
+    print('throughput: {:.1f} switches/min'.format(len(configured) / configured[-1] * 60))
+    print('p50:        {:.2f} s'.format(statistics.median(configured)))
+    print('p99:        {:.2f} s'.format(percentile(configured, 0.99)))
+    print('max:        {:.2f} s'.format(configured[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import statistics
+import struct
+import tempfile
+import threading
+import time
+import typing
+from io import BytesIO
+import lib.tftp
+
+
+class BenchClient(asyncio.DatagramProtocol):
+    def __init__(self, filename: str, blksize: int, windowsize: int):
+        self._filename = filename
+        self._blksize = blksize
+        self._windowsize = windowsize
+        self._transport: typing.Optional[asyncio.DatagramTransport] = None
+        self._expected = 1
+        self._received = 0
+        self.data = bytearray()
+        self.started = False
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def request(self, transport, server):
+        self._transport = transport
+        packet = struct.pack('!H', lib.tftp.OP_RRQ) + self._filename.encode('ascii') + b'\x00octet\x00'
+        if self._blksize != lib.tftp.DEFAULT_BLKSIZE:
+            packet += b'blksize\x00' + str(self._blksize).encode('ascii') + b'\x00'
+        if self._windowsize > 1:
+            packet += b'windowsize\x00' + str(self._windowsize).encode('ascii') + b'\x00'
+        transport.sendto(packet, server)
+
+    def datagram_received(self, packet, addr):
+        self.started = True
+        opcode, = struct.unpack('!H', packet[:2])
+        if opcode == lib.tftp.OP_OACK:
+            self._transport.sendto(struct.pack('!HH', lib.tftp.OP_ACK, 0), addr)
+            return
+        if opcode == lib.tftp.OP_ERROR:
+            self.done.set_exception(RuntimeError(packet[4:-1].decode('ascii')))
+            return
+        block, = struct.unpack('!H', packet[2:4])
+        if block != self._expected % 65536:
+            self._transport.sendto(struct.pack('!HH', lib.tftp.OP_ACK, (self._expected - 1) % 65536), addr)
+            return
+        payload = packet[4:]
+        self.data += payload
+        self._expected += 1
+        self._received += 1
+        last = len(payload) < self._blksize
+        if last or self._received % self._windowsize == 0:
+            self._transport.sendto(struct.pack('!HH', lib.tftp.OP_ACK, block), addr)
+        if last and not self.done.done():
+            self.done.set_result(bytes(self.data))
+
+
+async def fetch(server, filename: str, blksize: int, windowsize: int) -> float:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    transport, client = await loop.create_datagram_endpoint(
+        lambda: BenchClient(filename, blksize, windowsize),
+        local_addr=('127.0.0.1', 0),
+    )
+    try:
+        for _ in range(0, 5):
+            client.request(transport, server)
+            try:
+                await asyncio.wait_for(asyncio.shield(client.done), 2)
+                break
+            except asyncio.TimeoutError:
+                if client.started:
+                    break
+        await asyncio.wait_for(client.done, 30)
+    finally:
+        transport.close()
+    return time.perf_counter() - started
+
+
+def start_server(engine: str, payload: bytes) -> int:
+    def dyn_file_func(name, **kwargs):
+        return BytesIO(payload)
+
+    ready = threading.Event()
+    port = []
+
+    def run_builtin():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        srv = lib.tftp.TftpServer(dyn_file_func, host='127.0.0.1', port=0)
+        loop.run_until_complete(srv.start())
+        port.append(srv.port)
+        ready.set()
+        loop.run_forever()
+
+    def run_tftpy():
+        import socket
+        import tftpy
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        port.append(sock.getsockname()[1])
+        sock.close()
+        with tempfile.TemporaryDirectory() as td:
+            srv = tftpy.TftpServer(tftproot=td, dyn_file_func=dyn_file_func)
+            ready.set()
+            srv.listen('127.0.0.1', port[0])
+
+    threading.Thread(target=run_builtin if engine == 'builtin' else run_tftpy, daemon=True).start()
+    ready.wait()
+    time.sleep(0.2)
+    return port[0]
+
+
+async def run(args):
+    server = ('127.0.0.1', start_server(args.server, b'!' * args.size))
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *[fetch(server, 'network-confg', args.blksize, args.windowsize) for _ in range(0, args.concurrency)],
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+    durations = sorted(result for result in results if isinstance(result, float))
+    failures = len(results) - len(durations)
+    print('server:        {} (blksize {}, windowsize {})'.format(args.server, args.blksize, args.windowsize))
+    print('transfers:     {} ok, {} failed'.format(len(durations), failures))
+    print('total time:    {:.3f} s'.format(elapsed))
+    print('transfers/s:   {:.1f}'.format(len(durations) / elapsed))
+    if len(durations) > 0:
+        print('p50 transfer:  {:.1f} ms'.format(statistics.median(durations) * 1000))
+        print('max transfer:  {:.1f} ms'.format(durations[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='liscain tftp server throughput')
+    parser.add_argument('-s', '--server', choices=['builtin', 'tftpy'], default='builtin')
+    parser.add_argument('-c', '--concurrency', type=int, default=500, help='simultaneous requests')
+    parser.add_argument('-S', '--size', type=int, default=16384, help='file size in bytes')
+    parser.add_argument('-b', '--blksize', type=int, default=lib.tftp.DEFAULT_BLKSIZE)
+    parser.add_argument('-w', '--windowsize', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
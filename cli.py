@@ -4,23 +4,35 @@ import argparse
 import sys
 import time
 from lib.config import config
+import lib.wire
 
 
 init_parser = argparse.ArgumentParser(description='liscain-cli', add_help=False)
-init_parser.add_argument('mode', choices=['device', 'opt82'])
+init_parser.add_argument('mode', choices=['device', 'opt82', 'stats'])
+init_parser.add_argument('-e', '--encoding', required=False, help='command socket encoding', choices=lib.wire.encodings(), default=lib.wire.JSON)
 init_args, inner_args = init_parser.parse_known_args()
 
 parser = argparse.ArgumentParser(description='liscain-cli')
 if init_args.mode == 'device':
     parser.add_argument('-I', '--reinit-by-id', required=False, help='(re)initialize', type=int, default=None)
     parser.add_argument('-n', '--neighbor-info-by-id', required=False, help='show switch neighbor info by id', type=int, default=None)
+    parser.add_argument('-D', '--neighbor-info-detail', required=False, help='show detailed neighbor info', default=False, action='store_true')
+    parser.add_argument('-j', '--job', required=False, help='show result of a neighbor info job', default=None)
+    parser.add_argument('-w', '--wait', required=False, help='seconds to wait for neighbor info (0 = print job id)', type=float, default=30)
+    parser.add_argument('-t', '--trace-by-id', required=False, help='show recent task and command spans of a switch', type=int, default=None)
+    parser.add_argument('--spans', required=False, help='number of spans to show with --trace-by-id', type=int, default=50)
     parser.add_argument('-a', '--adopt-by-id', required=False, help='adopt a switch by id', type=int, default=None)
     parser.add_argument('-m', '--adopt-by-mac', required=False, help='adopt a switch by (partial) mac', default=None)
     parser.add_argument('-i', '--identity', required=False, help='identity of switch', default=None)
+    parser.add_argument('-c', '--config-file', required=False, help='config to push when adopting (default: {identity}.cfg in the server autoconf path)', default=None)
     parser.add_argument('-l', '--list', required=False, help='list switches', default=False, action='store_true')
     parser.add_argument('-d', '--delete-by-id', required=False, help='delete switch by id', default=None, type=int)
     parser.add_argument('-f', '--filter-list', required=False, help='filter list to states (can be repeated)', default=None, action='append')
     parser.add_argument('-x', '--filter-except', required=False, help='filter list excluding states (can be repeated)', default=None, action='append')
+    parser.add_argument('-p', '--prefix', required=False, help='filter list to identifiers starting with prefix', default=None)
+    parser.add_argument('-M', '--filter-mac', required=False, help='filter list to (partial) mac', default=None)
+    parser.add_argument('--limit', required=False, help='list at most this many switches', type=int, default=None)
+    parser.add_argument('--after', required=False, help='list switches with id greater than this', type=int, default=None)
 elif init_args.mode == 'opt82':
     parser.add_argument('-l', '--list', required=False, help='list option82 info', default=False, action='store_true')
     parser.add_argument('-d', '--delete-by-id', required=False, help='delete option 82 info by id', default=None, type=int)
@@ -41,51 +53,114 @@ def show_devices(device_listing):
         row = []
         for col in table.column_headers:
             row.append(device[col])
-        if args.filter_list is not None:
-            if device['state'] not in args.filter_list:
-                continue
-        if args.filter_except is not None:
-            if device['state'] in args.filter_except:
-                continue
         table.append_row(row)
     print(table)
 
 
 def list_devices(zmq_sock):
-    zmq_sock.send_json({'cmd': 'list'})
-    device_list = zmq_sock.recv_json()
+    lib.wire.send(
+        zmq_sock,
+        {
+            'cmd': 'list',
+            'states': args.filter_list,
+            'exclude_states': args.filter_except,
+            'prefix': args.prefix,
+            'mac': args.filter_mac,
+            'limit': args.limit,
+            'after_id': args.after
+        },
+        init_args.encoding
+    )
+    device_list = lib.wire.recv(zmq_sock)
+    if 'error' in device_list:
+        print(device_list['error'])
+        return
     show_devices(device_list)
 
 
-def get_devices(zmq_sock):
-    zmq_sock.send_json({'cmd': 'list'})
-    device_list = zmq_sock.recv_json()
+def get_devices(zmq_sock, **filters):
+    lib.wire.send(zmq_sock, dict(filters, cmd='list'), init_args.encoding)
+    device_list = lib.wire.recv(zmq_sock)
     return device_list
 
 
-def get_neigh_info(zmq_sock, device_id):
-    zmq_sock.send_json({'cmd': 'neighbor-info', 'id': device_id})
-    result = zmq_sock.recv_json()
+def get_neigh_info(zmq_sock, device_id, full, wait):
+    lib.wire.send(zmq_sock, {'cmd': 'neighbor-info', 'id': device_id, 'full': full}, init_args.encoding)
+    result = lib.wire.recv(zmq_sock)
     if 'error' in result:
         print(result['error'])
+        return
+    if wait <= 0 and result['state'] == 'pending':
+        print('job {}'.format(result['job']))
+        return
+    wait_job(zmq_sock, result, wait)
+
+
+def wait_job(zmq_sock, result, wait):
+    deadline = time.time() + wait
+    while result['state'] == 'pending' and time.time() < deadline:
+        time.sleep(0.5)
+        lib.wire.send(zmq_sock, {'cmd': 'job', 'id': result['job']}, init_args.encoding)
+        result = lib.wire.recv(zmq_sock)
+        if 'error' in result and 'state' not in result:
+            print(result['error'])
+            return
+    if result['state'] == 'pending':
+        print('job {} still pending'.format(result['job']))
+    elif 'error' in result:
+        print(result['error'])
     else:
         print(result['info'])
 
 
+def get_job(zmq_sock, job_id, wait):
+    lib.wire.send(zmq_sock, {'cmd': 'job', 'id': job_id}, init_args.encoding)
+    result = lib.wire.recv(zmq_sock)
+    if 'state' not in result:
+        print(result['error'])
+        return
+    wait_job(zmq_sock, result, wait)
+
+
+def show_trace(zmq_sock, device_id, limit):
+    lib.wire.send(zmq_sock, {'cmd': 'trace', 'id': device_id, 'limit': limit}, init_args.encoding)
+    spans = lib.wire.recv(zmq_sock)
+    if 'error' in spans:
+        print(spans['error'])
+        return
+    table = beautifultable.BeautifulTable()
+    table.default_alignment = beautifultable.ALIGN_LEFT
+    table.max_table_width = 144
+    table.column_headers = ['start', 'kind', 'name', 'elapsed', 'out', 'in', 'result']
+    for span in spans:
+        table.append_row([
+            time.strftime('%H:%M:%S', time.localtime(span['start'])) + '.{:03d}'.format(int(span['start'] * 1000) % 1000),
+            span['kind'],
+            span['name'],
+            '{:.3f}'.format(span['elapsed']),
+            span.get('bytes_out', ''),
+            span.get('bytes_in', ''),
+            span.get('error', span.get('state', '')),
+        ])
+    print(table)
+
+
 def adopt_device(zmq_sock, device_id, identity, config_filename):
-    with open(config_filename) as fp:
-        switch_config = fp.read()
-        zmq_sock.send_json({'cmd': 'adopt', 'id': device_id, 'identity': identity, 'config': switch_config})
-        result = zmq_sock.recv_json()
-        if 'error' in result:
-            print(result['error'])
-        else:
-            print(result['info'])
+    message = {'cmd': 'adopt', 'id': device_id, 'identity': identity}
+    if config_filename is not None:
+        with open(config_filename) as fp:
+            message['config'] = fp.read()
+    lib.wire.send(zmq_sock, message, init_args.encoding)
+    result = lib.wire.recv(zmq_sock)
+    if 'error' in result:
+        print(result['error'])
+    else:
+        print(result['info'])
 
 
 def delete_device(zmq_sock, device_id):
-    zmq_sock.send_json({'cmd': 'delete', 'id': device_id})
-    result = zmq_sock.recv_json()
+    lib.wire.send(zmq_sock, {'cmd': 'delete', 'id': device_id}, init_args.encoding)
+    result = lib.wire.recv(zmq_sock)
     if 'error' in result:
         print(result['error'])
     else:
@@ -110,15 +185,17 @@ def show_opt82_infos(results):
 
 
 def opt82_set_info(zmq_sock, upstream_mac, upstream_port, downstream_name):
-    zmq_sock.send_json(
+    lib.wire.send(
+        zmq_sock,
         {
             'cmd': 'opt82-info',
             'upstream_switch_mac': upstream_mac,
             'upstream_port_info': upstream_port,
             'downstream_switch_name': downstream_name
-        }
+        },
+        init_args.encoding
     )
-    result = zmq_sock.recv_json()
+    result = lib.wire.recv(zmq_sock)
     if 'error' in result:
         print(result['error'])
         return
@@ -126,22 +203,26 @@ def opt82_set_info(zmq_sock, upstream_mac, upstream_port, downstream_name):
 
 
 def opt82_list(zmq_sock):
-    zmq_sock.send_json(
+    lib.wire.send(
+        zmq_sock,
         {
             'cmd': 'opt82-list'
-        }
+        },
+        init_args.encoding
     )
-    show_opt82_infos(zmq_sock.recv_json())
+    show_opt82_infos(lib.wire.recv(zmq_sock))
 
 
 def opt82_delete_by_id(zmq_sock, opt82_id):
-    zmq_sock.send_json(
+    lib.wire.send(
+        zmq_sock,
         {
             'cmd': 'opt82-delete',
             'id': opt82_id
-        }
+        },
+        init_args.encoding
     )
-    result = zmq_sock.recv_json()
+    result = lib.wire.recv(zmq_sock)
     if 'error' in result:
         print(result['error'])
     else:
@@ -149,19 +230,33 @@ def opt82_delete_by_id(zmq_sock, opt82_id):
 
 
 def reinit(zmq_sock, reinit_id):
-    zmq_sock.send_json(
+    lib.wire.send(
+        zmq_sock,
         {
             'cmd': 'reinit',
             'id': reinit_id
-        }
+        },
+        init_args.encoding
     )
-    result = zmq_sock.recv_json()
+    result = lib.wire.recv(zmq_sock)
     if 'error' in result:
         print(result['error'])
     else:
         print(result['info'])
 
 
+def show_stats(zmq_sock):
+    lib.wire.send(zmq_sock, {'cmd': 'stats'}, init_args.encoding)
+    stats = lib.wire.recv(zmq_sock)
+    table = beautifultable.BeautifulTable()
+    table.default_alignment = beautifultable.ALIGN_LEFT
+    table.column_headers = ['component', 'counter', 'value']
+    for component, counters in stats.items():
+        for counter, value in counters.items():
+            table.append_row([component, counter, value])
+    print(table)
+
+
 def main():
     zmq_context = zmq.Context()
     zmq_sock = zmq_context.socket(zmq.REQ)
@@ -172,28 +267,26 @@ def main():
         if args.reinit_by_id is not None:
             reinit(zmq_sock, args.reinit_by_id)
         if args.neighbor_info_by_id is not None:
-            get_neigh_info(zmq_sock, args.neighbor_info_by_id)
+            get_neigh_info(zmq_sock, args.neighbor_info_by_id, args.neighbor_info_detail, args.wait)
+        if args.job is not None:
+            get_job(zmq_sock, args.job, args.wait)
+        if args.trace_by_id is not None:
+            show_trace(zmq_sock, args.trace_by_id, args.spans)
         if args.delete_by_id is not None:
             delete_device(zmq_sock, args.delete_by_id)
         if args.adopt_by_id is not None:
             if args.identity is None:
                 print('identity is required when adopting')
                 return
-            adopt_device(zmq_sock, args.adopt_by_id, args.identity, 'config/{}.cfg'.format(args.identity))
+            adopt_device(zmq_sock, args.adopt_by_id, args.identity, args.config_file)
         if args.adopt_by_mac is not None:
             if args.identity is None:
                 print('identity is required when adopting')
                 return
-            devices = get_devices(zmq_sock)
-            mac_matches = []
-            simplemac = args.adopt_by_mac.replace(':', '')
-            for device in devices:
-                if device['state'] not in ['READY', 'CONFIGURE_FAILED']:
-                    continue
-                if simplemac in device['mac_address'].replace(':', ''):
-                    mac_matches.append(device['id'])
+            devices = get_devices(zmq_sock, states=['READY', 'CONFIGURE_FAILED'], mac=args.adopt_by_mac, fields=['id'], limit=2)
+            mac_matches = [device['id'] for device in devices]
             if len(mac_matches) == 1:
-                adopt_device(zmq_sock, mac_matches[0], args.identity, 'config/{}.cfg'.format(args.identity))
+                adopt_device(zmq_sock, mac_matches[0], args.identity, args.config_file)
             elif len(mac_matches) > 1:
                 print('error: multiple mac_address matches')
             else:
@@ -212,6 +305,9 @@ def main():
                 return
             opt82_set_info(zmq_sock, args.upstream_mac, args.upstream_port, args.downstream_name)
 
+    if init_args.mode == 'stats':
+        show_stats(zmq_sock)
+
 
 if __name__ == '__main__':
     main()
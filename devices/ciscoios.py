@@ -1,6 +1,12 @@
 from lib.switchstate import SwitchState
-from lib.config import config
-import telnetlib
+import lib.config
+from lib.aiotelnet import TelnetSession
+from lib.config_repository import parse_confighints
+from lib.config_template import ConfigTemplate
+import lib.aiotelnet
+import lib.metrics
+import lib.trace
+import asyncio
 import re
 import socket
 import time
@@ -8,29 +14,60 @@ from io import StringIO
 import devices.device
 
 
+RE_MAC = re.compile(r'EtherSVI, address is ([0-9a-f.]+)')
+RE_PID = re.compile(r'PID: (WS-C[^\s]+)')
+RE_VERSION = re.compile(r'Cisco IOS.+Version ([^\s,]+)[, ]')
+RE_TCLSH_CONTINUATION = re.compile(b'\\+>')
+RE_TCLSH_LENGTH = re.compile(r'^\s*(\d+)\s*$', re.MULTILINE)
+RE_WHITESPACE = re.compile(r'\s')
+
+TCLSH_TIMEOUT = 30
+
+BASE_CONFIG = ConfigTemplate(
+    'baseconfig/cisco.cfg',
+    lambda: {
+        'liscain_adopt_dn': lib.config.current().liscain_adopt_dn,
+        'liscain_init_username': lib.config.current().liscain_init_username,
+        'liscain_init_password': lib.config.current().liscain_init_password,
+    }
+)
+
+telnet_command_seconds = lib.metrics.Histogram(
+    'liscain_telnet_command_seconds', 'Round trip from sending a command to matching the switch prompt'
+)
+
+
 class CiscoIOS(devices.device.Device):
     def __init__(self):
         super().__init__()
         self.device_class = 'CiscoIOS'
 
     def neighbor_info(self, full=False):
+        return lib.aiotelnet.run(self.neighbor_info_async(full))
+
+    def initial_setup(self) -> bool:
+        return lib.aiotelnet.run(self.initial_setup_async())
+
+    def configure(self, switch_config, temp_storage, confighints=None):
+        return lib.aiotelnet.run(self.configure_async(switch_config, temp_storage, confighints))
+
+    def change_identity(self, identity):
+        if not lib.aiotelnet.run(self.change_identity_async(identity)):
+            return False
+        return super().change_identity(identity)
+
+    async def _login(self, tc):
+        settings = lib.config.current()
+        await self._write(tc, None, [b'\r\n[Uu]sername: '])
+        await self._write(tc, settings.liscain_init_username, [b'\r\n[Pp]assword: '], secret=True)
+        await self._write(tc, settings.liscain_init_password, secret=True)
+
+    async def neighbor_info_async(self, full=False):
+        tc = None
         try:
-            tc = telnetlib.Telnet(self.address, timeout=3)
-            self._write(tc, None, [b'\r\n[Uu]sername: '])
-            self._write(tc, config.get('liscain', 'liscain_init_username'), [b'\r\n[Pp]assword: '])
-            self._write(tc, config.get('liscain', 'liscain_init_password'))
-            self._write(tc, 'terminal length 0')
-            nbr_info = ['cdp']
-            neigh_info_started = False
-            command = 'show cdp neigh detail' if full else 'show cdp neigh'
-            for line in self._write(tc, command).split('\n')[:-1]:
-                line = line.strip()
-                if 'Device ID' in line:
-                    neigh_info_started = True
-                if neigh_info_started:
-                    nbr_info.append(line)
-
-            return '\n'.join(nbr_info)
+            tc = await TelnetSession.open_address(self.address, timeout=3)
+            await self._login(tc)
+            return await self._neighbor_info(tc, full)
 
         except socket.timeout:
             self._logger.info('timeout getting neighbor info')
@@ -40,27 +77,33 @@ class CiscoIOS(devices.device.Device):
             self._logger.info('switch not ready while getting neighbor info')
             return 'unknown'
 
-    def initial_setup(self) -> bool:
+        finally:
+            if tc is not None:
+                tc.close()
+
+    async def _neighbor_info(self, tc, full):
+        await self._write(tc, 'terminal length 0')
+        nbr_info = ['cdp']
+        neigh_info_started = False
+        command = 'show cdp neigh detail' if full else 'show cdp neigh'
+        for line in (await self._write(tc, command)).split('\n')[:-1]:
+            line = line.strip()
+            if 'Device ID' in line:
+                neigh_info_started = True
+            if neigh_info_started:
+                nbr_info.append(line)
+        return '\n'.join(nbr_info)
+
+    async def initial_setup_async(self) -> bool:
         retry_max = 10
         for retry in range(1, retry_max+1):
+            tc = None
             try:
-                tc = telnetlib.Telnet(self.address, timeout=10)
-                self._write(tc, None, [b'\r\n[Uu]sername: '])
-                self._write(tc, config.get('liscain', 'liscain_init_username'), [b'\r\n[Pp]assword: '])
-                self._write(tc, config.get('liscain', 'liscain_init_password'))
+                tc = await TelnetSession.open_address(self.address, timeout=10)
+                await self._login(tc)
                 self._logger.debug('logged in')
-                self._write(tc, 'terminal length 0')
-                self._read_mac(tc)
-                self._read_pid(tc)
-                self._read_version(tc)
-                self._logger.info('generating ssh keys...')
-                self._write(tc, 'configure terminal')
-                self._write(tc, 'ip ssh rsa keypair-name ssh')
-                self._write(tc, 'crypto key generate rsa general-keys label ssh mod 2048', timeout=120)
-                self._write(tc, 'sdm prefer dual-ipv4-and-ipv6 default', timeout=10)
-                self._write(tc, 'sdm prefer dual-ipv4-and-ipv6 vlan', timeout=10)
-                self._write(tc, 'end')
-                self._write(tc, 'exit')
+                await self._setup(tc)
+                await self._write(tc, 'exit')
                 self._logger.debug('logged out')
                 self._logger.info('successfully initialized switch')
                 return True
@@ -69,154 +112,322 @@ class CiscoIOS(devices.device.Device):
                 continue
             except EOFError:
                 self._logger.info('switch not ready, wait 10s (retry %i/%i)', retry, retry_max)
-                time.sleep(10)
+                await asyncio.sleep(10)
+            finally:
+                if tc is not None:
+                    tc.close()
         self._logger.error('failed initial setup')
         return False
 
-    def _parse_confighints(self, config):
-        hints = {}
-        for line in config.split('\n'):
-            line = line.strip()
-            if not line.startswith('! liscain::'):
-                continue
-            key, value = line.split('::')[-1].split()
-            hints[key.strip()] = value.strip()
-        return hints
+    async def _setup(self, tc):
+        await self._write(tc, 'terminal length 0')
+        await self._discover(tc)
+        self._logger.info('generating ssh keys...')
+        await self._write(tc, 'configure terminal')
+        await self._write(tc, 'ip ssh rsa keypair-name ssh')
+        await self._write(tc, 'crypto key generate rsa general-keys label ssh mod 2048', timeout=120)
+        await self._write(tc, 'sdm prefer dual-ipv4-and-ipv6 default', timeout=10)
+        await self._write(tc, 'sdm prefer dual-ipv4-and-ipv6 vlan', timeout=10)
+        await self._write(tc, 'end')
 
-    def configure(self, switch_config, temp_storage):
-        try:
-            hints = self._parse_confighints(switch_config)
-            if 'device_type' in hints:
-                if not re.search(hints['device_type'], self.device_type, re.IGNORECASE):
-                    self._logger.error(
-                        '[configure] wrong device type, expected %s within %s',
-                        hints['device_type'],
-                        self.device_type,
-                    )
-                    return False
-            tc = telnetlib.Telnet(self.address, timeout=10)
-            self._write(tc, None, [b'\r\n[Uu]sername: '])
-            self._write(tc, config.get('liscain', 'liscain_init_username'), [b'\r\n[Pp]assword: '])
-            self._write(tc, config.get('liscain', 'liscain_init_password'))
-
-            config_source_tftp = config.get("liscain", "config_source_tftp", fallback=None)
-            config_source_http = config.get("liscain", "config_source_http", fallback=None)
+    def initial_setup_and_adopt(self, on_ready, temp_storage) -> SwitchState:
+        return lib.aiotelnet.run(self.initial_setup_and_adopt_async(on_ready, temp_storage))
 
-            self._logger.debug('[configure] logged in, begin configure')
-            self._write(tc, 'write')
-
-            if config_source_http:
-                k = temp_storage.store(switch_config)
-                http_config_url = f'http://{config_source_http}/adopt/{k}'
-                self._logger.info("[configure] copying config %s to startup-config", http_config_url)
-                self._write(tc, f'copy {http_config_url} startup-config', [b'\r\n'])
-                self._write(tc, 'startup-config', timeout=120)
-
-            elif config_source_tftp:
-                k = temp_storage.store(switch_config)
-                tftp_config_url = f'tftp://{config_source_tftp}/adopt/{k}'
-                self._logger.info("[configure] copying config %s to startup-config", tftp_config_url)
-                self._write(tc, f'copy {tftp_config_url} startup-config', [b'\r\n'])
-                self._write(tc, 'startup-config', timeout=120)
+    async def initial_setup_and_adopt_async(self, on_ready, temp_storage) -> SwitchState:
+        loop = asyncio.get_running_loop()
+        retry_max = 10
+        for retry in range(1, retry_max+1):
+            tc = None
+            try:
+                tc = await TelnetSession.open_address(self.address, timeout=10)
+                await self._login(tc)
+                self._logger.debug('logged in')
+                await self._setup(tc)
+                self._logger.info('successfully initialized switch')
+            except socket.timeout:
+                if tc is not None:
+                    tc.close()
+                self._logger.info('timeout, retry %i/%i', retry, retry_max)
+                continue
+            except EOFError:
+                if tc is not None:
+                    tc.close()
+                self._logger.info('switch not ready, wait 10s (retry %i/%i)', retry, retry_max)
+                await asyncio.sleep(10)
+                continue
 
-            else:
-                self._write(tc, 'terminal length 0')
-                self._write(tc, 'tclsh')
-                tclsh_exp = [b'\\+>']
-                self._write(tc, 'puts [open "flash:liscain.config.in" w+] {', tclsh_exp, newline='\r')
-                for config_line in switch_config.split('\n'):
-                    config_line = config_line.strip()
-                    self._write(tc, config_line, tclsh_exp, newline='\r')
-                self._write(tc, '}')
-                self._write(tc, 'exit')
-                self._write(tc, 'copy flash:liscain.config.in startup-config', [b'\r\n'])
-                self._write(tc, 'startup-config')
+            def session_neighbor_info(full=False):
+                try:
+                    return asyncio.run_coroutine_threadsafe(self._neighbor_info(tc, full), loop).result()
+                except (socket.timeout, EOFError):
+                    self._logger.info('switch went away while getting neighbor info')
+                    return 'unknown'
 
             try:
-                prompt = self._write(tc, 'reload', [b'yes/no', b'confirm'])
-                if 'yes/no' in prompt:
-                    time.sleep(1)
-                    self._write(tc, 'no', [b'confirm'])
-                time.sleep(1)
-                self._write(tc, '')
-            except socket.timeout:
-                pass
-            self._logger.debug('[configure] completed')
-            return True
+                adoption = await loop.run_in_executor(None, on_ready, session_neighbor_info)
+                if adoption is None:
+                    await self._write(tc, 'exit')
+                    self._logger.debug('logged out')
+                    return SwitchState.READY
+
+                identity, switch_config, confighints = adoption
+                if not self._check_confighints(switch_config, confighints):
+                    return SwitchState.CONFIGURE_FAILED
+                old_identity = self.identifier
+                try:
+                    await self._change_hostname(tc, identity)
+                except (socket.timeout, EOFError):
+                    self.identifier = old_identity
+                    self._logger.info('identity setup failed')
+                    return SwitchState.CONFIGURE_FAILED
+                await loop.run_in_executor(None, super().change_identity, identity)
+
+                self._logger.debug('[configure] begin configure')
+                try:
+                    if not await self._configure(tc, switch_config, temp_storage):
+                        return SwitchState.CONFIGURE_FAILED
+                except socket.timeout:
+                    self._logger.error('[configure] timed out')
+                    return SwitchState.CONFIGURE_FAILED
+                except EOFError:
+                    pass
+                return SwitchState.CONFIGURED
+            except (socket.timeout, EOFError):
+                return SwitchState.READY
+            finally:
+                tc.close()
+        self._logger.error('failed initial setup')
+        return SwitchState.INIT_FAILED
+
+    def _check_confighints(self, switch_config, hints=None):
+        if hints is None:
+            hints = parse_confighints(switch_config)
+        if 'device_type' in hints:
+            if not re.search(hints['device_type'], self.device_type, re.IGNORECASE):
+                self._logger.error(
+                    '[configure] wrong device type, expected %s within %s',
+                    hints['device_type'],
+                    self.device_type,
+                )
+                return False
+        return True
+
+    async def configure_async(self, switch_config, temp_storage, confighints=None):
+        tc = None
+        try:
+            if not self._check_confighints(switch_config, confighints):
+                return False
+            tc = await TelnetSession.open_address(self.address, timeout=10)
+            await self._login(tc)
+            self._logger.debug('[configure] logged in, begin configure')
+            return await self._configure(tc, switch_config, temp_storage)
         except socket.timeout:
             self._logger.error('[configure] timed out')
             return False
         except EOFError:
             return True
+        finally:
+            if tc is not None:
+                tc.close()
 
-    def change_identity(self, identity):
+    async def _configure(self, tc, switch_config, temp_storage):
+        settings = lib.config.current()
+        config_source_tftp = settings.config_source_tftp
+        config_source_http = settings.config_source_http
+
+        await self._write(tc, 'write')
+
+        if config_source_http:
+            k = temp_storage.store(switch_config)
+            http_config_url = f'http://{config_source_http}/adopt/{k}'
+            self._logger.info("[configure] copying config %s to startup-config", http_config_url)
+            await self._write(tc, f'copy {http_config_url} startup-config', [b'\r\n'])
+            await self._write(tc, 'startup-config', timeout=120)
+
+        elif config_source_tftp:
+            k = temp_storage.store(switch_config)
+            tftp_config_url = f'tftp://{config_source_tftp}/adopt/{k}'
+            self._logger.info("[configure] copying config %s to startup-config", tftp_config_url)
+            await self._write(tc, f'copy {tftp_config_url} startup-config', [b'\r\n'])
+            await self._write(tc, 'startup-config', timeout=120)
+
+        else:
+            await self._write(tc, 'terminal length 0')
+            await self._write(tc, 'tclsh')
+            if not await self._upload_tclsh(tc, switch_config):
+                await self._write(tc, 'exit')
+                return False
+            await self._write(tc, 'exit')
+            await self._write(tc, 'copy flash:liscain.config.in startup-config', [b'\r\n'])
+            await self._write(tc, 'startup-config')
+
+        try:
+            prompt = await self._write(tc, 'reload', [b'yes/no', b'confirm'])
+            if 'yes/no' in prompt:
+                await asyncio.sleep(1)
+                await self._write(tc, 'no', [b'confirm'])
+            await asyncio.sleep(1)
+            await self._write(tc, '')
+        except socket.timeout:
+            pass
+        self._logger.debug('[configure] completed')
+        return True
+
+    async def _upload_tclsh(self, tc, switch_config, timeout=TCLSH_TIMEOUT):
+        tclsh_exp = [RE_TCLSH_CONTINUATION]
+        chunk_lines = lib.config.current().tclsh_upload_chunk_lines
+        config_lines = [config_line.strip() for config_line in switch_config.split('\n')]
+        # keep the channel so it can be closed, tcl only flushes the buffered write on close
+        await self._write(tc, 'set out [open "flash:liscain.config.in" w+]; puts $out {', tclsh_exp, timeout, newline='\r')
+        if chunk_lines <= 1:
+            for config_line in config_lines:
+                await self._write(tc, config_line, tclsh_exp, timeout, newline='\r')
+        else:
+            for offset in range(0, len(config_lines), chunk_lines):
+                chunk = config_lines[offset:offset + chunk_lines]
+                span_name = 'tclsh upload lines {}-{}'.format(offset + 1, offset + len(chunk))
+                with lib.trace.tracer.command(self.id, span_name) as span:
+                    payload = ''.join('{}\r'.format(config_line) for config_line in chunk).encode('ascii')
+                    tc.write(payload)
+                    span['bytes_out'] = len(payload)
+                    await tc.drain()
+                    for _ in chunk:
+                        index, match, data = await tc.expect(tclsh_exp, timeout=timeout)
+                        span['bytes_in'] += len(data)
+                        if index == -1:
+                            span['error'] = 'timeout'
+                            self._logger.error('[configure] tclsh upload timed out in %s', span_name)
+                            return False
+        await self._write(tc, '}; close $out', timeout=timeout)
+
+        expected_length = len(RE_WHITESPACE.sub('', ''.join(config_lines)))
+        output = await self._write(
+            tc,
+            'set f [open "flash:liscain.config.in" r]; regsub -all {\\s} [read $f] {} liscain_in; close $f; '
+            'puts [string length $liscain_in]',
+            timeout=timeout
+        )
+        lengths = RE_TCLSH_LENGTH.findall(output)
+        if len(lengths) == 0 or int(lengths[-1]) != expected_length:
+            self._logger.error(
+                '[configure] uploaded config does not match, expected %i characters, switch has %s',
+                expected_length,
+                lengths[-1] if len(lengths) > 0 else 'unknown'
+            )
+            return False
+        return True
+
+    async def change_identity_async(self, identity):
         old_identity = self.identifier
+        tc = None
         try:
-            tc = telnetlib.Telnet(self.address, timeout=10)
-            self._write(tc, None, [b'\r\n[Uu]sername: '])
-            self._write(tc, config.get('liscain', 'liscain_init_username'), [b'\r\n[Pp]assword: '])
-            self._write(tc, config.get('liscain', 'liscain_init_password'))
+            tc = await TelnetSession.open_address(self.address, timeout=10)
+            await self._login(tc)
             self._logger.debug('[change_identity] logged in')
-            self._write(tc, 'terminal length 0')
-            self._write(tc, 'configure terminal')
-            self.identifier = identity
-            self._write(tc, 'hostname {}'.format(identity))
-            self._write(tc, 'end')
-            self._write(tc, 'exit')
+            await self._change_hostname(tc, identity)
+            await self._write(tc, 'exit')
             self._logger.debug('[change_identity] logged out')
-            return super().change_identity(identity)
+            return True
         except socket.timeout:
             self.identifier = old_identity
             return False
         except EOFError:
             self.identifier = old_identity
             return False
+        finally:
+            if tc is not None:
+                tc.close()
 
-    def _write(self, telnet_client, data, expect=None, timeout=None, newline='\n'):
-        if data is not None:
-            telnet_client.write('{}{}'.format(data, newline).encode('ascii'))
-        if expect is not None:
-            _, match, data = telnet_client.expect(expect, timeout=timeout)
-            return data.decode('ascii')
-        else:
-            _, match, data = telnet_client.expect(
-                ['\r\n{}(\\([a-zA-Z0-9-.,]+\\))?#'.format(self.identifier).encode('ascii')],
-                timeout=timeout
-            )
+    async def _change_hostname(self, tc, identity):
+        await self._write(tc, 'terminal length 0')
+        await self._write(tc, 'configure terminal')
+        self.identifier = identity
+        await self._write(tc, 'hostname {}'.format(identity))
+        await self._write(tc, 'end')
+
+    async def _write(self, telnet_client, data, expect=None, timeout=None, newline='\n', secret=False, name=None):
+        with lib.trace.tracer.command(self.id, data if name is None else name, secret) as span:
+            started = time.monotonic()
+            if data is not None:
+                payload = '{}{}'.format(data, newline).encode('ascii')
+                telnet_client.write(payload)
+                span['bytes_out'] = len(payload)
+            if expect is not None:
+                _, match, data = await telnet_client.expect(expect, timeout=timeout)
+            else:
+                _, match, data = await telnet_client.expect(
+                    ['\r\n{}(\\([a-zA-Z0-9-.,]+\\))?#'.format(self.identifier).encode('ascii')],
+                    timeout=timeout
+                )
+            span['bytes_in'] = len(data)
+            telnet_command_seconds.observe(time.monotonic() - started)
             return data.decode('ascii')
 
-    def _read_mac(self, telnet_client):
-        data = re.search(r'EtherSVI, address is ([0-9a-f.]+)', self._write(telnet_client, 'show interface vlan1'))
-        if data is not None:
-            mac = data.group(1)
-            mac = mac.replace('.', '')
-            mac_list = []
-            for mac_byte in range(0, 6):
-                mac_list.append('{}{}'.format(mac[mac_byte * 2], mac[mac_byte * 2 + 1]))
-            self.mac_address = ':'.join(mac_list).lower()
-            self._logger.info('mac address detected as %s', self.mac_address)
-        pass
-
-    def _read_pid(self, telnet_client):
-        data = re.search(r'PID: (WS-C[^\s]+)', self._write(telnet_client, 'show inventory'))
-        if data is not None:
-            self.device_type = data.group(1)
-            self._logger.info('type detected as %s', self.device_type)
-            self.save()
-
-    def _read_version(self, telnet_client):
-        data = re.search(r'Cisco IOS.+Version ([^\s,]+)[, ]', self._write(telnet_client, 'show version'))
-        if data is not None:
-            self.version = data.group(1)
-            self._logger.info('version detected as %s', self.version)
-            self.save()
+    async def _save(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.save)
+
+    async def _write_batch(self, telnet_client, commands, timeout=None):
+        telnet_client.write(''.join('{}\n'.format(command) for command in commands).encode('ascii'))
+        outputs = []
+        for command in commands:
+            outputs.append(await self._write(telnet_client, None, timeout=timeout, name=command))
+        return outputs
+
+    async def _discover(self, telnet_client):
+        if not lib.config.current().discovery_pipelined:
+            await self._read_mac(telnet_client)
+            await self._read_pid(telnet_client)
+            await self._read_version(telnet_client)
+            return
+        mac_output, pid_output, version_output = await self._write_batch(
+            telnet_client,
+            ['show interface vlan1', 'show inventory', 'show version']
+        )
+        changed = self._parse_mac(mac_output)
+        changed = self._parse_pid(pid_output) or changed
+        changed = self._parse_version(version_output) or changed
+        if changed:
+            await self._save()
+
+    def _parse_mac(self, output):
+        data = RE_MAC.search(output)
+        if data is None:
+            return False
+        mac = data.group(1)
+        mac = mac.replace('.', '')
+        mac_list = []
+        for mac_byte in range(0, 6):
+            mac_list.append('{}{}'.format(mac[mac_byte * 2], mac[mac_byte * 2 + 1]))
+        self.mac_address = ':'.join(mac_list).lower()
+        self._logger.info('mac address detected as %s', self.mac_address)
+        return True
+
+    def _parse_pid(self, output):
+        data = RE_PID.search(output)
+        if data is None:
+            return False
+        self.device_type = data.group(1)
+        self._logger.info('type detected as %s', self.device_type)
+        return True
+
+    def _parse_version(self, output):
+        data = RE_VERSION.search(output)
+        if data is None:
+            return False
+        self.version = data.group(1)
+        self._logger.info('version detected as %s', self.version)
+        return True
+
+    async def _read_mac(self, telnet_client):
+        self._parse_mac(await self._write(telnet_client, 'show interface vlan1'))
+
+    async def _read_pid(self, telnet_client):
+        if self._parse_pid(await self._write(telnet_client, 'show inventory')):
+            await self._save()
+
+    async def _read_version(self, telnet_client):
+        if self._parse_version(await self._write(telnet_client, 'show version')):
+            await self._save()
 
     def emit_base_config(self):
-        with open('baseconfig/cisco.cfg') as fp:
-            conf = fp.read().format(
-                liscain_hostname=self.identifier,
-                liscain_adopt_dn=config.get('liscain', 'liscain_adopt_dn'),
-                liscain_init_username=config.get('liscain', 'liscain_init_username'),
-                liscain_init_password=config.get('liscain', 'liscain_init_password'),
-            )
-            return StringIO(conf)
+        return StringIO(BASE_CONFIG.render(liscain_hostname=self.identifier))
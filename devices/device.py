@@ -1,12 +1,14 @@
 import lib.db
 from lib.switchstate import SwitchState
-from sqlalchemy import Column, Integer, String, orm, Enum
+from sqlalchemy import Column, Integer, String, orm, Enum, Index
 import logging
-from enum import Enum as PyEnum
 
 
 class Device(lib.db.base):
     __tablename__ = 'devices'
+    __table_args__ = (
+        Index('ix_devices_identifier_state', 'identifier', 'state'),
+    )
     id = Column(Integer, primary_key=True)
     identifier = Column(String, nullable=False, default=None)
     address = Column(String, nullable=False, default=None)
@@ -35,13 +37,26 @@ class Device(lib.db.base):
         self._logger = logging.getLogger('[{}]'.format(self.identifier))
         self._logger.debug('load switch from database')
 
-    def neighbor_info(self):
+    def neighbor_info(self, full=False):
         self._logger.error('called default neighbor info, this is not implemented')
         return 'unknown'
 
     def initial_setup(self) -> bool:
         raise NotImplementedError('initial setup not implemented')
 
+    def initial_setup_and_adopt(self, on_ready, temp_storage) -> SwitchState:
+        if not self.initial_setup():
+            return lib.switchstate.SwitchState.INIT_FAILED
+        adoption = on_ready(self.neighbor_info)
+        if adoption is None:
+            return lib.switchstate.SwitchState.READY
+        identity, switch_config, confighints = adoption
+        if not self.change_identity(identity):
+            return lib.switchstate.SwitchState.CONFIGURE_FAILED
+        if not self.configure(switch_config, temp_storage, confighints):
+            return lib.switchstate.SwitchState.CONFIGURE_FAILED
+        return lib.switchstate.SwitchState.CONFIGURED
+
     def change_state(self, state: SwitchState):
         self._logger.info('change state %s -> %s', self.state, state)
         self.state = state
@@ -54,7 +69,7 @@ class Device(lib.db.base):
         self._logger = logging.getLogger('[{}]'.format(self.identifier))
         return True
 
-    def configure(self, _config, _temp_storage):
+    def configure(self, _config, _temp_storage, _confighints=None):
         self._logger.error('called default configure, no-op! setting device to CONFIGURE_FAILED')
         self.change_state(lib.switchstate.SwitchState.CONFIGURE_FAILED)
 
@@ -64,16 +79,5 @@ class Device(lib.db.base):
             ses.commit()
 
     def as_dict(self):
-        ret = {}
-        for col in self.__table__.columns:
-            val = getattr(self, col.name)
-            if isinstance(val, str):
-                ret[col.name] = val
-            elif isinstance(val, int):
-                ret[col.name] = val
-            elif isinstance(val, float):
-                ret[col.name] = val
-            elif isinstance(val, PyEnum):
-                ret[col.name] = str(val)
-        return ret
+        return lib.db.as_dict(self)
 
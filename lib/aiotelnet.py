@@ -0,0 +1,162 @@
+import asyncio
+import re
+import socket
+import threading
+import typing
+
+
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+TELNET_PORT = 23
+
+
+def split_address(address: str) -> typing.Tuple[str, int]:
+    # plain addresses use the telnet port, host:port and [v6]:port point at a console server or simulator
+    if address.startswith('['):
+        host, _, port = address[1:].partition(']')
+        return host, int(port[1:]) if port.startswith(':') else TELNET_PORT
+    if address.count(':') == 1:
+        host, port = address.split(':')
+        return host, int(port)
+    return address, TELNET_PORT
+
+
+class TelnetSession:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._cooked = bytearray()
+        self._iac_buffer = bytearray()
+        self._in_subnegotiation = False
+        self.eof = False
+
+    @classmethod
+    async def open(cls, host: str, port: int = TELNET_PORT, timeout: typing.Optional[float] = None) -> 'TelnetSession':
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout('timed out connecting to {}:{}'.format(host, port))
+        return cls(reader, writer)
+
+    @classmethod
+    async def open_address(cls, address: str, timeout: typing.Optional[float] = None) -> 'TelnetSession':
+        host, port = split_address(address)
+        return await cls.open(host, port, timeout)
+
+    def write(self, data: bytes):
+        self._writer.write(data.replace(bytes([IAC]), bytes([IAC, IAC])))
+
+    async def drain(self):
+        await self._writer.drain()
+
+    def close(self):
+        self._writer.close()
+
+    def _process(self, raw: bytes):
+        for byte in raw:
+            if len(self._iac_buffer) == 0:
+                if byte == IAC:
+                    self._iac_buffer.append(byte)
+                elif not self._in_subnegotiation and byte not in (0, 17):
+                    self._cooked.append(byte)
+                continue
+            self._iac_buffer.append(byte)
+            command = self._iac_buffer[1]
+            if command in (DO, DONT, WILL, WONT):
+                if len(self._iac_buffer) < 3:
+                    continue
+                option = self._iac_buffer[2]
+                if command == DO:
+                    self._writer.write(bytes([IAC, WONT, option]))
+                elif command == WILL:
+                    self._writer.write(bytes([IAC, DONT, option]))
+            elif command == IAC:
+                if not self._in_subnegotiation:
+                    self._cooked.append(IAC)
+            elif command == SB:
+                self._in_subnegotiation = True
+            elif command == SE:
+                self._in_subnegotiation = False
+            self._iac_buffer.clear()
+
+    def _consume(self, length: typing.Optional[int] = None) -> bytes:
+        if length is None:
+            length = len(self._cooked)
+        data = bytes(self._cooked[:length])
+        del self._cooked[:length]
+        return data
+
+    async def expect(self, expect_list: typing.List[typing.Union[bytes, typing.Pattern]], timeout: typing.Optional[float] = None):
+        patterns = []
+        for pattern in expect_list:
+            if not hasattr(pattern, 'search'):
+                pattern = re.compile(pattern)
+            patterns.append(pattern)
+
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if timeout is not None:
+            deadline = loop.time() + timeout
+        while True:
+            for index, pattern in enumerate(patterns):
+                match = pattern.search(self._cooked)
+                if match is not None:
+                    return index, match, self._consume(match.end())
+            if self.eof:
+                if len(self._cooked) == 0:
+                    raise EOFError('telnet connection closed')
+                return -1, None, self._consume()
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return -1, None, self._consume()
+            try:
+                raw = await asyncio.wait_for(self._reader.read(4096), remaining)
+            except asyncio.TimeoutError:
+                return -1, None, self._consume()
+            except ConnectionError:
+                raw = b''
+            if len(raw) == 0:
+                self.eof = True
+            self._process(raw)
+
+
+class SessionEngine:
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='telnet-engine', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+
+_engine: typing.Optional[SessionEngine] = None
+_engine_lock = threading.Lock()
+
+
+def engine() -> SessionEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SessionEngine()
+        return _engine
+
+
+def run(coroutine):
+    return engine().run(coroutine)
@@ -2,7 +2,7 @@ from lib.db import sql_ses, base
 from sqlalchemy import Column, Integer, String, orm, Enum, and_, not_
 import sqlalchemy.orm
 import logging
-from lib.config import config
+import lib.config
 import time
 from devices import remap_to_subclass
 from devices.device import Device
@@ -11,60 +11,103 @@ from lib.switchstate import SwitchState
 import threading
 from lib.commander import Commander
 from lib.temp_storage import TempStorage
+from lib.config_repository import ConfigRepository
 import re
-import requests
+import typing
+from lib.jaspy import JaspyClient
+
+
+RE_CISCO_CDP_REMOTE_DEVICE = re.compile(
+    r'^Device ID: (?P<remote_device>.+?)$',
+    re.MULTILINE
+)
+RE_CISCO_CDP_INTERFACES = re.compile(
+    r'^Interface: (?P<local_interface>.+?),(.+)?Port ID \(outgoing port\): (?P<remote_interface>.+)$',
+    re.MULTILINE
+)
+
+
+def parse_cdp_neighbors(cdp_info: str) -> typing.List[typing.Tuple[str, str]]:
+    neighbors = []
+    for switch_data in cdp_info.split('------'):
+        if 'Device ID' not in switch_data:
+            continue
+        switch_data = switch_data.strip('-')
+        remote_device_match = RE_CISCO_CDP_REMOTE_DEVICE.search(switch_data)
+        interfaces_match = RE_CISCO_CDP_INTERFACES.search(switch_data)
+        if not remote_device_match or not interfaces_match:
+            continue
+        neighbors.append((remote_device_match.group('remote_device'), interfaces_match.group('remote_interface')))
+    return neighbors
 
 
 class CDPAdopter:
-    def __init__(self, commander: Commander, temp_storage: TempStorage):
+    def __init__(self, commander: Commander, temp_storage: TempStorage, config_repository: ConfigRepository):
         self._logger = logging.getLogger('cdp-adopter')
         self._commander = commander
         self._temp_storage = temp_storage
-
-    def _jaspy_lookup(self, device, remote_device, remote_interface):
-        self._logger.info(
-            'cdp_adopter/%s: reverse lookup %s: %s',
-            device.identifier, remote_device, remote_interface
+        self._config_repository = config_repository
+        settings = lib.config.current()
+        self.jaspy = JaspyClient(
+            settings.autoconf_cdp_jaspy_api,
+            ttl=settings.autoconf_cdp_jaspy_ttl,
+            workers=settings.autoconf_cdp_jaspy_workers,
+            timeout=settings.autoconf_cdp_jaspy_timeout,
         )
-        jaspy_api = config.get('liscain', 'autoconf_cdp_jaspy_api')
-        fqdn = '{}'.format(remote_device)
-        device_interfaces = requests.get('{}/interface'.format(jaspy_api), params={'device_fqdn': fqdn}).json()
-        whoami = None
+
+    @staticmethod
+    def _whoami(device_interfaces, remote_interface):
         for device_interface in device_interfaces:
             if remote_interface == device_interface['name'] or remote_interface == device_interface['description']:
                 for part in device_interface['alias'].split():
                     if 'liscain:' in part:
                         _, whoami = part.split(':', 1)
-                        break
-                if whoami is not None:
-                    break
-        return whoami
+                        return whoami
+        return None
 
-    def autoadopt(self, device):
-        re_cisco_cdp_remote_device = re.compile(
-            r'^Device ID: (?P<remote_device>.+?)$',
-            re.MULTILINE
-        )
-        re_cisco_cdp_interfaces = re.compile(
-            r'^Interface: (?P<local_interface>.+?),(.+)?Port ID \(outgoing port\): (?P<remote_interface>.+)$',
-            re.MULTILINE
-        )
-        cdp_info = device.neighbor_info(True)
+    def _jaspy_lookup(self, device, neighbors):
+        for remote_device, remote_interface in neighbors:
+            self._logger.info(
+                'cdp_adopter/%s: reverse lookup %s: %s',
+                device.identifier, remote_device, remote_interface
+            )
+        interfaces = self.jaspy.interfaces_many(remote_device for remote_device, _ in neighbors)
         whoami_results = set()
-        for switch_data in cdp_info.split('------'):
-            if 'Device ID' not in switch_data:
-                continue
-            switch_data = switch_data.strip('-')
-            remote_device_match = re_cisco_cdp_remote_device.search(switch_data)
-            interfaces_match = re_cisco_cdp_interfaces.search(switch_data)
-            if not remote_device_match or not interfaces_match:
+        for remote_device, remote_interface in neighbors:
+            if interfaces[remote_device] is None:
                 continue
-            groupdict_remotedev = remote_device_match.groupdict()
-            groupdict_ifaces = interfaces_match.groupdict()
-
-            whoami = self._jaspy_lookup(device, groupdict_remotedev['remote_device'], groupdict_ifaces['remote_interface'])
+            whoami = self._whoami(interfaces[remote_device], remote_interface)
             if whoami is not None:
                 whoami_results.add(whoami)
+            else:
+                # cabling may have been documented after the list was cached, look again next time
+                self.jaspy.invalidate(remote_device)
+        return whoami_results
+
+    def autoadopt(self, device):
+        adoption = self.resolve(device)
+        if adoption is None:
+            return
+        switch_name, switch_config, confighints = adoption
+        try:
+            self._commander.enqueue(
+                device,
+                tasks.DeviceConfigurationTask(
+                    device,
+                    identity=switch_name,
+                    configuration=switch_config,
+                    confighints=confighints,
+                    temp_storage=self._temp_storage
+                ),
+            )
+        except BaseException as e:
+            self._logger.error(e)
+
+    def resolve(self, device, neighbor_info=None):
+        if neighbor_info is None:
+            neighbor_info = device.neighbor_info
+        neighbors = parse_cdp_neighbors(neighbor_info(True))
+        whoami_results = self._jaspy_lookup(device, neighbors)
 
         switch_name = None
         if len(whoami_results) == 1:
@@ -86,17 +129,7 @@ class CDPAdopter:
             )
             return
 
-        autoconf_path = config.get('liscain', 'autoconf_path')
-        whitelisted_prefixes = config.get('liscain', 'autoconf_version_whitelist_prefix')
-        version_ok = False
-        if whitelisted_prefixes is None:
-            version_ok = True
-        else:
-            whitelisted_prefixes = whitelisted_prefixes.split(',')
-            for whitelisted_prefix in whitelisted_prefixes:
-                if device.version.startswith(whitelisted_prefix):
-                    version_ok = True
-                    break
+        version_ok = lib.config.current().version_allowed(device.version)
 
         if not version_ok:
             self._logger.info(
@@ -105,21 +138,11 @@ class CDPAdopter:
             )
             return
 
-        config_path = '{}/{}.cfg'.format(autoconf_path, switch_name)
         self._logger.info('cdp_adopter/%s: trying autoadopt for %s', device.identifier, switch_name)
-        switch_config = None
-        try:
-            with open(config_path) as fp:
-                switch_config = fp.read()
-        except FileNotFoundError:
-            self._logger.error('cdp_adopter/%s: failed to open %s for switch autoconfiguration', device.identifier, config_path)
+        switch_config = self._config_repository.get(switch_name)
+        if switch_config is None:
+            self._logger.error('cdp_adopter/%s: no config found for %s for switch autoconfiguration', device.identifier, switch_name)
             return
-        try:
-            self._commander.enqueue(
-                device,
-                tasks.DeviceConfigurationTask(device, identity=switch_name, configuration=switch_config, temp_storage=self._temp_storage),
-            )
-        except BaseException as e:
-            self._logger.error(e)
+        return switch_name, switch_config.text, switch_config.hints
 
 
@@ -0,0 +1,60 @@
+import threading
+import time
+import typing
+
+
+class RequestCoalescer:
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._entries: typing.Dict[str, typing.Tuple[float, typing.Any]] = dict()
+        self._in_flight: typing.Dict[str, threading.Event] = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: str, compute: typing.Callable[[], typing.Any]):
+        if self._ttl <= 0:
+            with self._lock:
+                self.misses += 1
+            return compute()
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return entry[1]
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    self.misses += 1
+                    in_flight = threading.Event()
+                    self._in_flight[key] = in_flight
+                    break
+            # another request for the same key is being served, answer from its result
+            in_flight.wait()
+
+        try:
+            value = compute()
+            with self._lock:
+                self._prune()
+                self._entries[key] = (time.monotonic() + self._ttl, value)
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.set()
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
@@ -0,0 +1,85 @@
+import concurrent.futures
+import logging
+import struct
+import threading
+import typing
+import zmq
+import lib.wire
+
+
+RESULTS_ENDPOINT = 'inproc://liscain-command-results'
+
+
+class CommandServer:
+    def __init__(self, zmq_context: zmq.Context, endpoint: str, handler: typing.Callable[[dict], typing.Any],
+                 workers: int = 4):
+        self._logger = logging.getLogger('command-server')
+        self._zmq_context = zmq_context
+        self._endpoint = endpoint
+        self._handler = handler
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='command')
+        self._local = threading.local()
+        self._next_seq: typing.Dict[tuple, int] = dict()
+        self._send_seq: typing.Dict[tuple, int] = dict()
+        self._pending_replies: typing.Dict[tuple, typing.Dict[int, bytes]] = dict()
+
+    def _results_socket(self) -> zmq.Socket:
+        results_socket = getattr(self._local, 'results_socket', None)
+        if results_socket is None:
+            results_socket = self._zmq_context.socket(zmq.PUSH)
+            results_socket.connect(RESULTS_ENDPOINT)
+            self._local.results_socket = results_socket
+        return results_socket
+
+    def _work(self, envelope: typing.List[bytes], seq: int, message, encoding: str):
+        try:
+            body = lib.wire.encode(self._handler(message), encoding)
+        except Exception as e:
+            self._logger.exception(e)
+            # always answer, a missing reply would stall every later reply for this client
+            body = lib.wire.encode({'error': str(e)}, encoding)
+        self._results_socket().send_multipart([struct.pack('!Q', seq)] + envelope + [body])
+
+    def _dispatch(self, frames: typing.List[bytes]):
+        envelope, body = frames[:-1], frames[-1]
+        client = tuple(envelope)
+        seq = self._next_seq.get(client, 0)
+        self._next_seq[client] = seq + 1
+        self._send_seq.setdefault(client, 0)
+        try:
+            message, encoding = lib.wire.decode(body)
+        except ValueError:
+            message, encoding = None, lib.wire.JSON
+        if not isinstance(message, dict):
+            message = {'cmd': None}
+        self._pool.submit(self._work, envelope, seq, message, encoding)
+
+    def _reply(self, frontend: zmq.Socket, frames: typing.List[bytes]):
+        seq, = struct.unpack('!Q', frames[0])
+        envelope, body = frames[1:-1], frames[-1]
+        client = tuple(envelope)
+        pending = self._pending_replies.setdefault(client, dict())
+        pending[seq] = body
+        # replies go out in request order per client, hold back any that finished early
+        while self._send_seq[client] in pending:
+            frontend.send_multipart(envelope + [pending.pop(self._send_seq[client])])
+            self._send_seq[client] += 1
+        if self._send_seq[client] == self._next_seq[client]:
+            del self._send_seq[client]
+            del self._next_seq[client]
+            del self._pending_replies[client]
+
+    def serve_forever(self):
+        frontend = self._zmq_context.socket(zmq.ROUTER)
+        frontend.bind(self._endpoint)
+        results = self._zmq_context.socket(zmq.PULL)
+        results.bind(RESULTS_ENDPOINT)
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(results, zmq.POLLIN)
+        while True:
+            events = dict(poller.poll())
+            if frontend in events:
+                self._dispatch(frontend.recv_multipart())
+            if results in events:
+                self._reply(frontend, results.recv_multipart())
@@ -1,47 +1,125 @@
 from devices.device import Device
+import collections
+import logging
 import typing
-from lib.commandqueue import CommandQueue
+from lib.commandqueue import CommandQueue, TaskQueue, run_task
 import threading
 import tasks
-import time
 
 
 class Commander(threading.Thread):
-    def __init__(self):
+    def __init__(self, pool_size: int = 0):
         super().__init__()
-        self._command_queues: typing.Dict[int, CommandQueue] = dict()
+        self._logger = logging.getLogger('commander')
+        self._command_queues: typing.Dict[int, TaskQueue] = dict()
         self._command_queue_lock = threading.Lock()
         self._stop_event = threading.Event()
+        self._pool_size = pool_size
+        self._workers: typing.List[threading.Thread] = list()
+        self._ready_devices: typing.Deque[int] = collections.deque()
+        self._active_devices: typing.Set[int] = set()
+        self._ready_condition = threading.Condition(self._command_queue_lock)
 
     def enqueue(self, device: Device, task: tasks.DeviceTask):
+        if self._pool_size > 0:
+            self._enqueue_pooled(device, task)
+            return
         with self._command_queue_lock:
             if device.id not in self._command_queues:
-                self._command_queues[device.id] = CommandQueue(device)
+                self._command_queues[device.id] = CommandQueue(device, on_drain=self._reap)
             if not self.is_alive():
                 self.start()
             self._command_queues[device.id].enqueue_task(task)
 
+    def _enqueue_pooled(self, device: Device, task: tasks.DeviceTask):
+        with self._command_queue_lock:
+            if not self.is_alive():
+                self.start()
+            task_queue = self._command_queues.get(device.id)
+            if task_queue is None:
+                task_queue = TaskQueue(device)
+            task_queue.enqueue_task(task)
+            self._command_queues[device.id] = task_queue
+            if device.id not in self._active_devices and device.id not in self._ready_devices:
+                self._ready_devices.append(device.id)
+                self._ready_condition.notify()
+
+    def _reap(self, command_queue: CommandQueue) -> bool:
+        with self._command_queue_lock:
+            if command_queue.length() > 0:
+                return False
+            if self._command_queues.get(command_queue.device_id) is command_queue:
+                del self._command_queues[command_queue.device_id]
+            return True
+
     def get_queue_list(self, device):
         with self._command_queue_lock:
             if device.id not in self._command_queues:
                 return []
             return self._command_queues[device.id].get_queue_list()
 
+    def queue_lengths(self) -> typing.Dict[int, int]:
+        with self._command_queue_lock:
+            return {device_id: task_queue.length() for device_id, task_queue in self._command_queues.items()}
+
+    # read without the queue lock so a scrape never waits behind enqueue or a worker, may be one task stale
+    def queue_depth(self) -> int:
+        return sum(task_queue.length() for task_queue in list(self._command_queues.values()))
+
+    def active_workers(self) -> int:
+        if self._pool_size > 0:
+            return len(self._active_devices)
+        return sum(1 for task_queue in list(self._command_queues.values()) if task_queue.length() > 0)
+
     def stop(self):
         self._stop_event.set()
+        with self._ready_condition:
+            self._ready_condition.notify_all()
         if self.is_alive():
             self.join()
 
-    def run(self):
-        while not self._stop_event.is_set():
-            with self._command_queue_lock:
-                delete_list = []
-                for device_id, command_queue in self._command_queues.items():
-                    if command_queue.length() == 0 or not command_queue.is_alive():
-                        command_queue.stop()
-                        delete_list.append(device_id)
-                for device_id in delete_list:
+    def _pool_worker(self):
+        while True:
+            with self._ready_condition:
+                while len(self._ready_devices) == 0 and not self._stop_event.is_set():
+                    self._ready_condition.wait()
+                if self._stop_event.is_set():
+                    return
+                device_id = self._ready_devices.popleft()
+                self._active_devices.add(device_id)
+                task_queue = self._command_queues[device_id]
+
+            task: typing.Optional[tasks.DeviceTask] = task_queue.peek_task()
+            try:
+                run_task(task)
+            except Exception as e:
+                self._logger.error('task %s for device %s failed: %s', task.__class__.__name__, device_id, e)
+                self._logger.exception(e)
+
+            with self._ready_condition:
+                task_queue.task_done()
+                self._active_devices.discard(device_id)
+                if task_queue.length() > 0:
+                    self._ready_devices.append(device_id)
+                    self._ready_condition.notify()
+                else:
                     del self._command_queues[device_id]
-            self._stop_event.wait(60)
 
+    def _run_pool(self):
+        for worker_id in range(0, self._pool_size):
+            worker = threading.Thread(target=self._pool_worker, name='commander-{}'.format(worker_id), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._stop_event.wait()
+        for worker in self._workers:
+            worker.join()
 
+    def run(self):
+        if self._pool_size > 0:
+            self._run_pool()
+            return
+        self._stop_event.wait()
+        with self._command_queue_lock:
+            command_queues = list(self._command_queues.values())
+        for command_queue in command_queues:
+            command_queue.stop()
@@ -2,15 +2,36 @@ from devices.device import Device
 import tasks
 import typing
 import threading
+import logging
+import lib.metrics
+import lib.trace
 
 
-class CommandQueue(threading.Thread):
+TASK_BUCKETS = (.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+task_seconds = lib.metrics.Histogram(
+    'liscain_task_duration_seconds', 'Device task run time by task class', ['task'], buckets=TASK_BUCKETS
+)
+tasks_failed = lib.metrics.Counter('liscain_tasks_failed_total', 'Device tasks that raised', ['task'])
+
+
+def run_task(task: tasks.DeviceTask):
+    task_name = task.__class__.__name__
+    with task_seconds.labels(task_name).time(), lib.trace.tracer.task(task.device.id, task_name) as span:
+        try:
+            task.run()
+            span['state'] = str(task.device.state)
+            task.post()
+        except Exception:
+            tasks_failed.labels(task_name).inc()
+            raise
+
+
+class TaskQueue:
     def __init__(self, device: Device):
-        super().__init__()
         self._device: Device = device
         self._command_queue: typing.List[tasks.DeviceTask] = list()
         self._command_queue_lock = threading.Lock()
-        self._stop_event = threading.Event()
 
     def enqueue_task(self, task: tasks.DeviceTask):
         with self._command_queue_lock:
@@ -20,34 +41,69 @@ class CommandQueue(threading.Thread):
                         raise KeyError('task already exists, will not enqueue')
             task.validate()
             self._command_queue.append(task)
-        if not self.is_alive():
-            self.start()
 
     def get_queue_list(self):
         out = []
         with self._command_queue_lock:
             for item in self._command_queue:
-                out.append(item.__class__)
+                out.append(item.__class__.__name__)
         return out
 
+    @property
+    def device_id(self):
+        return self._device.id
+
     def length(self):
         return len(self._command_queue)
 
+    def peek_task(self) -> typing.Optional[tasks.DeviceTask]:
+        with self._command_queue_lock:
+            if len(self._command_queue) > 0:
+                return self._command_queue[0]
+            return None
+
+    def task_done(self):
+        with self._command_queue_lock:
+            del self._command_queue[0]
+
+
+class CommandQueue(TaskQueue, threading.Thread):
+    def __init__(self, device: Device, on_drain: typing.Optional[typing.Callable[['CommandQueue'], bool]] = None):
+        TaskQueue.__init__(self, device)
+        threading.Thread.__init__(self)
+        self._logger = logging.getLogger('cqueue/{}'.format(device.id))
+        self._stop_event = threading.Event()
+        self._task_available = threading.Condition(self._command_queue_lock)
+        self._on_drain = on_drain
+
+    def enqueue_task(self, task: tasks.DeviceTask):
+        super().enqueue_task(task)
+        with self._task_available:
+            self._task_available.notify()
+        if not self.is_alive():
+            self.start()
+
     def stop(self):
         self._stop_event.set()
-        if self.is_alive():
+        with self._task_available:
+            self._task_available.notify_all()
+        if self.is_alive() and threading.current_thread() is not self:
             self.join()
 
     def run(self):
         while not self._stop_event.is_set():
             task: typing.Optional[tasks.DeviceTask] = None
-            with self._command_queue_lock:
+            with self._task_available:
+                while len(self._command_queue) == 0 and not self._stop_event.is_set() and self._on_drain is None:
+                    self._task_available.wait()
                 if len(self._command_queue) > 0:
                     task = self._command_queue[0]
             if task is not None:
-                task.run()
-                task.post()
-                with self._command_queue_lock:
-                    del self._command_queue[0]
-            else:
-                self._stop_event.wait(1)
+                try:
+                    run_task(task)
+                except Exception as e:
+                    self._logger.error('task %s failed: %s', task.__class__.__name__, e)
+                    self._logger.exception(e)
+                self.task_done()
+            elif self._on_drain is not None and self._on_drain(self):
+                return
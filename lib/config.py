@@ -1,6 +1,144 @@
 import configparser
+import logging
+import threading
+import typing
 
 
-config = configparser.ConfigParser()
-with open('config.ini') as fp:
-    config.read_file(fp)
+CONFIG_FILE = 'config.ini'
+SECTION = 'liscain'
+AUTOCONF_MODES = ('cdp', 'opt82')
+TFTP_SERVERS = ('tftpy', 'builtin')
+REQUIRED = object()
+
+
+def read_config(path: str = CONFIG_FILE) -> configparser.ConfigParser:
+    parser = configparser.ConfigParser()
+    with open(path) as fp:
+        parser.read_file(fp)
+    return parser
+
+
+config = read_config()
+
+
+class Settings:
+    def __init__(self, parser: configparser.ConfigParser):
+        if not parser.has_section(SECTION):
+            raise ValueError('missing [{}] section'.format(SECTION))
+
+        def get(key, fallback=REQUIRED):
+            if fallback is REQUIRED:
+                if not parser.has_option(SECTION, key):
+                    raise ValueError('{} is required'.format(key))
+                return parser.get(SECTION, key)
+            return parser.get(SECTION, key, fallback=fallback)
+
+        def number(getter, key, fallback, minimum=0):
+            try:
+                value = getter(SECTION, key, fallback=fallback)
+            except ValueError as e:
+                raise ValueError('{}: {}'.format(key, e))
+            if value is not None and value < minimum:
+                raise ValueError('{} must be at least {}'.format(key, minimum))
+            return value
+
+        def boolean(key, fallback):
+            try:
+                return parser.getboolean(SECTION, key, fallback=fallback)
+            except ValueError as e:
+                raise ValueError('{}: {}'.format(key, e))
+
+        def choice(key, choices, fallback):
+            value = get(key, fallback)
+            if value is not None and value not in choices:
+                raise ValueError('{} must be one of {}'.format(key, ', '.join(choices)))
+            return value
+
+        self.liscain_adopt_dn: str = get('liscain_adopt_dn')
+        self.liscain_init_username: str = get('liscain_init_username')
+        self.liscain_init_password: str = get('liscain_init_password')
+        self.database: str = get('database')
+        self.command_socket: str = get('command_socket')
+        self.opt82_zmq_listener: str = get('opt82_zmq_listener')
+
+        self.autoconf_enabled: bool = boolean('autoconf_enabled', False)
+        self.autoconf_mode: typing.Optional[str] = choice('autoconf_mode', AUTOCONF_MODES, None)
+        if self.autoconf_enabled and self.autoconf_mode is None:
+            raise ValueError('autoconf_enabled requires autoconf_mode ({})'.format(', '.join(AUTOCONF_MODES)))
+        self.autoconf_single_session: bool = boolean('autoconf_single_session', True)
+        self.autoconf_path: str = get('autoconf_path', 'config')
+        self.autoconf_poll_interval: float = number(parser.getfloat, 'autoconf_poll_interval', 5)
+        whitelist = get('autoconf_version_whitelist_prefix', None)
+        self.autoconf_version_whitelist_prefix: typing.Optional[typing.Tuple[str, ...]] = None
+        if whitelist is not None:
+            self.autoconf_version_whitelist_prefix = tuple(whitelist.split(','))
+        self.autoconf_cdp_jaspy_api: typing.Optional[str] = get('autoconf_cdp_jaspy_api', None)
+        self.autoconf_cdp_jaspy_ttl: float = number(parser.getfloat, 'autoconf_cdp_jaspy_ttl', 300)
+        self.autoconf_cdp_jaspy_workers: int = number(parser.getint, 'autoconf_cdp_jaspy_workers', 8, 1)
+        self.autoconf_cdp_jaspy_timeout: float = number(parser.getfloat, 'autoconf_cdp_jaspy_timeout', 5)
+
+        self.opt82_zmq_hwm: int = number(parser.getint, 'opt82_zmq_hwm', 10000)
+        self.opt82_batch_max: int = number(parser.getint, 'opt82_batch_max', 500, 1)
+        self.command_workers: int = number(parser.getint, 'command_workers', 4, 1)
+        self.neighbor_info_ttl: float = number(parser.getfloat, 'neighbor_info_ttl', 60)
+        self.neighbor_info_workers: int = number(parser.getint, 'neighbor_info_workers', 4, 1)
+        self.commander_pool_size: int = number(parser.getint, 'commander_pool_size', 0)
+        self.discovery_pipelined: bool = boolean('discovery_pipelined', True)
+        self.tclsh_upload_chunk_lines: int = number(parser.getint, 'tclsh_upload_chunk_lines', 64)
+
+        self.tftp_server: str = choice('tftp_server', TFTP_SERVERS, 'tftpy')
+        self.tftp_port: int = number(parser.getint, 'tftp_port', 69)
+        self.tftp_max_windowsize: int = number(parser.getint, 'tftp_max_windowsize', 64, 1)
+        self.tftp_coalesce_ttl: float = number(parser.getfloat, 'tftp_coalesce_ttl', 30)
+
+        self.serve_http: bool = boolean('serve_http', False)
+        self.http_port: typing.Optional[int] = number(parser.getint, 'http_port', None)
+        if self.serve_http and self.http_port is None:
+            raise ValueError('serve_http requires http_port')
+        self.config_source_http: typing.Optional[str] = get('config_source_http', None)
+        self.config_source_tftp: typing.Optional[str] = get('config_source_tftp', None)
+
+        self.temp_storage_ttl: float = number(parser.getfloat, 'temp_storage_ttl', 3600)
+        self.temp_storage_max_bytes: int = number(parser.getint, 'temp_storage_max_bytes', 64 * 1024 * 1024)
+        self.temp_storage_one_shot: bool = boolean('temp_storage_one_shot', False)
+
+        self.trace_file: typing.Optional[str] = get('trace_file', None)
+        self.trace_max_bytes: int = number(parser.getint, 'trace_max_bytes', 16 * 1024 * 1024, 1)
+        self.trace_backup_count: int = number(parser.getint, 'trace_backup_count', 5)
+        self.trace_ring_size: int = number(parser.getint, 'trace_ring_size', 256, 1)
+
+    def version_allowed(self, version: str) -> bool:
+        if self.autoconf_version_whitelist_prefix is None:
+            return True
+        return version.startswith(self.autoconf_version_whitelist_prefix)
+
+
+_current: typing.Optional[Settings] = None
+_lock = threading.Lock()
+
+
+def current() -> Settings:
+    global _current
+    settings = _current
+    if settings is None:
+        with _lock:
+            if _current is None:
+                _current = Settings(config)
+            settings = _current
+    return settings
+
+
+def reload(path: str = CONFIG_FILE) -> bool:
+    global _current
+    logger = logging.getLogger('config')
+    try:
+        settings = Settings(read_config(path))
+    except (OSError, configparser.Error, ValueError) as e:
+        logger.error('failed to reload %s, keeping current settings: %s', path, e)
+        return False
+    old_settings = current()
+    with _lock:
+        _current = settings
+    changed = sorted(key for key, value in vars(settings).items() if vars(old_settings).get(key) != value)
+    logger.info('reloaded %s, changed: %s', path, ', '.join(changed) if len(changed) > 0 else 'nothing')
+    return True
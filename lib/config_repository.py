@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+import typing
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+CONFIG_SUFFIX = '.cfg'
+MAX_MISSING = 4096
+
+
+def parse_confighints(switch_config: str) -> typing.Dict[str, str]:
+    hints = {}
+    for line in switch_config.split('\n'):
+        line = line.strip()
+        if not line.startswith('! liscain::'):
+            continue
+        key, value = line.split('::')[-1].split()
+        hints[key.strip()] = value.strip()
+    return hints
+
+
+class SwitchConfig:
+    __slots__ = ('name', 'mtime', 'text', 'hints')
+
+    def __init__(self, name: str, mtime: float, text: str):
+        self.name = name
+        self.mtime = mtime
+        self.text = text
+        self.hints = parse_confighints(text)
+
+
+class ConfigRepository:
+    def __init__(self, path: str, poll_interval: float = 5):
+        self._logger = logging.getLogger('config-repository')
+        self._path = path
+        self._poll_interval = poll_interval
+        self._configs: typing.Dict[str, SwitchConfig] = dict()
+        self._missing: typing.Dict[str, float] = dict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.misses = 0
+        self.watcher: typing.Optional[str] = None
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        # names come from clients, they must not reach outside the autoconf path
+        return len(name) > 0 and name not in ('.', '..') and os.path.basename(name) == name and \
+            os.sep not in name and (os.altsep is None or os.altsep not in name)
+
+    def _file_path(self, name: str) -> str:
+        return os.path.join(self._path, '{}{}'.format(name, CONFIG_SUFFIX))
+
+    def _scan(self) -> typing.Dict[str, float]:
+        mtimes = {}
+        try:
+            with os.scandir(self._path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(CONFIG_SUFFIX) and entry.is_file():
+                        mtimes[entry.name[:-len(CONFIG_SUFFIX)]] = entry.stat().st_mtime
+        except FileNotFoundError:
+            self._logger.error('autoconf path %s does not exist', self._path)
+        except OSError as e:
+            self._logger.error('failed to scan autoconf path %s: %s', self._path, e)
+        return mtimes
+
+    def _load(self, name: str) -> typing.Optional[SwitchConfig]:
+        try:
+            mtime = os.stat(self._file_path(name)).st_mtime
+            with open(self._file_path(name)) as fp:
+                switch_config = SwitchConfig(name, mtime, fp.read())
+        except (OSError, ValueError) as e:
+            if isinstance(e, ValueError):
+                self._logger.error('failed to parse confighints in %s: %s', self._file_path(name), e)
+            elif not isinstance(e, FileNotFoundError):
+                self._logger.error('failed to read %s: %s', self._file_path(name), e)
+            with self._lock:
+                self._configs.pop(name, None)
+            return None
+        with self._lock:
+            self._configs[name] = switch_config
+            self._missing.pop(name, None)
+            self.loads += 1
+        return switch_config
+
+    def load(self):
+        for name in self._scan():
+            self._load(name)
+        self._logger.info('indexed %s switch configs in %s', len(self._configs), self._path)
+
+    def refresh(self):
+        mtimes = self._scan()
+        with self._lock:
+            removed = [name for name in self._configs if name not in mtimes]
+            for name in removed:
+                del self._configs[name]
+            changed = [
+                name for name, mtime in mtimes.items()
+                if name not in self._configs or self._configs[name].mtime != mtime
+            ]
+        for name in changed:
+            self._load(name)
+        if len(removed) > 0 or len(changed) > 0:
+            self._logger.info('reloaded %s and dropped %s switch configs', len(changed), len(removed))
+
+    def get(self, name: str) -> typing.Optional[SwitchConfig]:
+        if not self.valid_name(name):
+            self._logger.warning('rejected config name %r', name)
+            return None
+        now = time.monotonic()
+        with self._lock:
+            switch_config = self._configs.get(name)
+            if switch_config is not None:
+                return switch_config
+            self.misses += 1
+            # unknown names are only looked up on disk again once the watcher had a chance to pick them up
+            if now - self._missing.get(name, -self._poll_interval) < self._poll_interval:
+                return None
+        # written after the last scan and not yet picked up by the watcher
+        switch_config = self._load(name)
+        if switch_config is None:
+            with self._lock:
+                if len(self._missing) >= MAX_MISSING:
+                    self._missing.clear()
+                self._missing[name] = now
+        return switch_config
+
+    def _watch_inotify(self):
+        inotify = inotify_simple.INotify()
+        watch_flags = inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO | \
+            inotify_simple.flags.MOVED_FROM | inotify_simple.flags.DELETE | inotify_simple.flags.CREATE
+        inotify.add_watch(self._path, watch_flags)
+        # catch anything that changed between load() and the watch being set up
+        self.refresh()
+        while True:
+            names = set()
+            for event in inotify.read():
+                if event.name.endswith(CONFIG_SUFFIX):
+                    names.add(event.name[:-len(CONFIG_SUFFIX)])
+            for name in names:
+                self._load(name)
+
+    def watch(self):
+        if inotify_simple is not None:
+            self._logger.info('watching %s with inotify', self._path)
+            self.watcher = 'inotify'
+            try:
+                self._watch_inotify()
+            except OSError as e:
+                self._logger.error('inotify watch on %s failed (%s), polling every %ss', self._path, e, self._poll_interval)
+        else:
+            self._logger.info('inotify_simple is not installed, polling %s every %ss', self._path, self._poll_interval)
+        self.watcher = 'poll'
+        while True:
+            time.sleep(self._poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                self._logger.exception(e)
+
+    def stats(self):
+        return {
+            'configs': len(self._configs),
+            'loads': self.loads,
+            'misses': self.misses,
+            'watcher': self.watcher,
+        }
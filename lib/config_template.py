@@ -0,0 +1,73 @@
+import logging
+import os
+import string
+import threading
+import time
+import typing
+
+
+class ConfigTemplate:
+    def __init__(self, path: str, static_fields: typing.Callable[[], typing.Dict[str, str]], check_interval: float = 1):
+        self._logger = logging.getLogger('config-template')
+        self._path = path
+        self._static_fields = static_fields
+        self._check_interval = check_interval
+        self._formatter = string.Formatter()
+        self._parts: typing.Optional[typing.Tuple[tuple, ...]] = None
+        self._mtime = None
+        self._static = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self.compiles = 0
+
+    def _compile(self, text: str, static: typing.Dict[str, str]) -> typing.Tuple[tuple, ...]:
+        # fold static fields into the surrounding text, only per-device fields are left for render()
+        parts = []
+        literal = ''
+        for literal_text, field_name, format_spec, conversion in self._formatter.parse(text):
+            literal += literal_text
+            if field_name is None:
+                continue
+            if field_name in static:
+                value = self._formatter.convert_field(static[field_name], conversion)
+                literal += self._formatter.format_field(value, format_spec)
+                continue
+            parts.append((literal, field_name, conversion, format_spec))
+            literal = ''
+        parts.append((literal, None, None, None))
+        return tuple(parts)
+
+    def _check(self):
+        now = time.monotonic()
+        if self._parts is not None and now < self._next_check:
+            return
+        with self._lock:
+            if self._parts is not None and now < self._next_check:
+                return
+            self._next_check = now + self._check_interval
+            try:
+                mtime = os.stat(self._path).st_mtime
+            except OSError as e:
+                if self._parts is None:
+                    raise
+                self._logger.error('failed to check %s, keeping loaded template: %s', self._path, e)
+                return
+            static = self._static_fields()
+            if self._parts is not None and mtime == self._mtime and static == self._static:
+                return
+            with open(self._path) as fp:
+                self._parts = self._compile(fp.read(), static)
+            self._mtime = mtime
+            self._static = static
+            self.compiles += 1
+            self._logger.info('compiled %s', self._path)
+
+    def render(self, **fields) -> str:
+        self._check()
+        out = []
+        for literal, field_name, conversion, format_spec in self._parts:
+            out.append(literal)
+            if field_name is not None:
+                value = self._formatter.convert_field(fields[field_name], conversion)
+                out.append(self._formatter.format_field(value, format_spec))
+        return ''.join(out)
@@ -1,5 +1,9 @@
 import logging
-from sqlalchemy import create_engine
+import time
+import typing
+import lib.metrics
+from sqlalchemy import create_engine, inspect, Enum
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import scoped_session, sessionmaker
 from contextlib import contextmanager
 from sqlalchemy.ext.declarative import declarative_base
@@ -7,6 +11,8 @@ from sqlalchemy.ext.declarative import declarative_base
 
 base = declarative_base()
 session = None
+_row_serializers: typing.Dict[str, typing.Callable[[typing.Any], dict]] = dict()
+session_seconds = lib.metrics.Histogram('liscain_db_session_seconds', 'Time spent inside sql_ses() blocks')
 
 
 def initialize(engine_spec):
@@ -15,19 +21,60 @@ def initialize(engine_spec):
         engine_spec
     )
     base.metadata.create_all(engine)
+    migrate(engine)
     session_factory = sessionmaker(bind=engine)
     session = scoped_session(session_factory)
 
 
+def migrate(engine):
+    logger = logging.getLogger('sql-migrate')
+    inspector = inspect(engine)
+    for table in base.metadata.sorted_tables:
+        existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(bind=engine)
+                logger.info('created index %s on %s', index.name, table.name)
+            except SQLAlchemyError as e:
+                logger.error('failed to create index %s on %s (duplicate rows?): %s', index.name, table.name, e)
+
+
+def row_serializer(table) -> typing.Callable[[typing.Any], dict]:
+    serializer = _row_serializers.get(table.name)
+    if serializer is not None:
+        return serializer
+    columns = tuple((column.name, isinstance(column.type, Enum)) for column in table.columns)
+
+    def serialize(row) -> dict:
+        ret = {}
+        for name, is_enum in columns:
+            val = getattr(row, name)
+            if val is None:
+                continue
+            ret[name] = str(val) if is_enum else val
+        return ret
+
+    _row_serializers[table.name] = serialize
+    return serialize
+
+
+def as_dict(row) -> dict:
+    return row_serializer(row.__table__)(row)
+
+
 @contextmanager
 def sql_ses():
     global session
     logger = logging.getLogger('sql-sm')
+    started = time.monotonic()
     try:
         yield session()
     except BaseException as be:
         logger.error('exception during sql-session (%s), rolling back uncommitted data', be)
         logger.exception(be)
     session.remove()
+    session_seconds.observe(time.monotonic() - started)
 
 
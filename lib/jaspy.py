@@ -0,0 +1,48 @@
+import concurrent.futures
+import logging
+import typing
+import requests
+import requests.adapters
+from lib.coalescer import RequestCoalescer
+
+
+class JaspyClient:
+    def __init__(self, api: typing.Optional[str], ttl: float = 300, workers: int = 8, timeout: float = 5):
+        self._logger = logging.getLogger('jaspy')
+        self._api = api
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='jaspy')
+        self._cache = RequestCoalescer(ttl)
+
+    def _fetch(self, fqdn: str) -> typing.List[dict]:
+        response = self._session.get(
+            '{}/interface'.format(self._api),
+            params={'device_fqdn': fqdn},
+            timeout=self._timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def interfaces(self, fqdn: str) -> typing.List[dict]:
+        return self._cache.get_or_compute(fqdn, lambda: self._fetch(fqdn))
+
+    def interfaces_many(self, fqdns: typing.Iterable[str]) -> typing.Dict[str, typing.Optional[typing.List[dict]]]:
+        futures = {fqdn: self._executor.submit(self.interfaces, fqdn) for fqdn in set(fqdns)}
+        results = {}
+        for fqdn, future in futures.items():
+            try:
+                results[fqdn] = future.result()
+            except (requests.RequestException, ValueError) as e:
+                self._logger.error('jaspy: interface lookup for %s failed: %s', fqdn, e)
+                results[fqdn] = None
+        return results
+
+    def invalidate(self, fqdn: str):
+        self._cache.invalidate(fqdn)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,69 @@
+import concurrent.futures
+import logging
+import threading
+import time
+import typing
+import uuid
+
+
+class NeighborInfoJobs:
+    def __init__(self, ttl: float = 60, workers: int = 4, retention: float = 600):
+        self._logger = logging.getLogger('neighbor-info-jobs')
+        self._ttl = ttl
+        self._retention = max(retention, ttl)
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='neighbor-info')
+        self._jobs: typing.Dict[str, dict] = dict()
+        self._latest: typing.Dict[typing.Tuple[int, bool], str] = dict()
+        self._lock = threading.Lock()
+
+    def submit(self, device, full: bool = False) -> dict:
+        key = (device.id, full)
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(self._latest.get(key))
+            if job is not None:
+                if job['state'] == 'pending':
+                    return dict(job)
+                if job['state'] == 'done' and time.time() - job['timestamp'] < self._ttl:
+                    return dict(job, cached=True)
+            job = {
+                'job': str(uuid.uuid4()),
+                'id': device.id,
+                'full': full,
+                'state': 'pending',
+                'submitted': time.time(),
+            }
+            self._jobs[job['job']] = job
+            self._latest[key] = job['job']
+        self._executor.submit(self._run, job, device)
+        return dict(job)
+
+    def get(self, job_id: str) -> typing.Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return dict(job)
+
+    def _run(self, job: dict, device):
+        try:
+            info = device.neighbor_info(job['full'])
+            error = None
+        except Exception as e:
+            self._logger.exception(e)
+            info = None
+            error = str(e)
+        with self._lock:
+            job['state'] = 'done' if error is None else 'failed'
+            job['timestamp'] = time.time()
+            job['info'] = info
+            if error is not None:
+                job['error'] = error
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if now - job.get('timestamp', now) > self._retention]:
+            job = self._jobs.pop(job_id)
+            key = (job['id'], job['full'])
+            if self._latest.get(key) == job_id:
+                del self._latest[key]
@@ -0,0 +1,207 @@
+import math
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels: typing.Sequence[typing.Tuple[str, str]]) -> str:
+    if len(labels) == 0:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ))
+
+
+# writers serialize on a per-value lock that is only held for the update itself, readers never lock:
+# attribute reads and list copies are atomic, a scrape may at worst see one observation half applied
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._function: typing.Optional[typing.Callable[[], float]] = None
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function: typing.Callable[[], float]):
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def get(self):
+        if self._function is not None:
+            return self._function()
+        return self.value
+
+    def samples(self, name: str, labels: typing.List[typing.Tuple[str, str]]):
+        yield name, labels, self.get()
+
+
+class _HistogramValue:
+    def __init__(self, buckets: typing.Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        index = len(self._buckets)
+        for bucket_index, bound in enumerate(self._buckets):
+            if value <= bound:
+                index = bucket_index
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started)
+
+    def samples(self, name: str, labels: typing.List[typing.Tuple[str, str]]):
+        counts = list(self._counts)
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), counts):
+            cumulative += count
+            yield '{}_bucket'.format(name), labels + [('le', _format_value(bound))], cumulative
+        yield '{}_count'.format(name), labels, cumulative
+        yield '{}_sum'.format(name), labels, self._sum
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: typing.Dict[typing.Tuple[str, ...], typing.Any] = dict()
+        self._lock = threading.Lock()
+        if len(self.labelnames) == 0:
+            self._children[()] = self._new_value()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_value(self):
+        raise NotImplementedError('_new_value not implemented')
+
+    def labels(self, *labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError('{} expects labels {}'.format(self.name, ', '.join(self.labelnames)))
+        key = tuple(str(value) for value in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_value())
+        return child
+
+    def _unlabeled(self):
+        if len(self.labelnames) > 0:
+            raise ValueError('{} has labels, use labels()'.format(self.name))
+        return self._children[()]
+
+    def samples(self):
+        for key, child in list(self._children.items()):
+            yield from child.samples(self.name, list(zip(self.labelnames, key)))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._unlabeled().inc(amount)
+
+    def set_function(self, function: typing.Callable[[], float]):
+        self._unlabeled().set_function(function)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self._unlabeled().dec(amount)
+
+    def set(self, value):
+        self._unlabeled().set(value)
+
+    def track_inprogress(self):
+        return self._unlabeled().track_inprogress()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS, registry=None):
+        self._buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_value(self):
+        return _HistogramValue(self._buckets)
+
+    def observe(self, value: float):
+        self._unlabeled().observe(value)
+
+    def time(self):
+        return self._unlabeled().time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: typing.Dict[str, _Metric] = dict()
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('metric {} already registered'.format(metric.name))
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> typing.Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        out = []
+        for metric in list(self._metrics.values()):
+            out.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            out.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                out.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(out) + '\n'
+
+
+REGISTRY = Registry()
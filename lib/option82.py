@@ -1,21 +1,29 @@
+import lib.db
 from lib.db import sql_ses, base
-from sqlalchemy import Column, Integer, String, orm, Enum, and_, not_
+from sqlalchemy import Column, Integer, String, orm, Enum, Index, and_, not_, or_
 import sqlalchemy.orm
 import logging
-from lib.config import config
+import lib.config
 import zmq
+import lib.wire
 import time
 from devices import remap_to_subclass
 from devices.device import Device
 import tasks
 from lib.switchstate import SwitchState
 import threading
+import typing
 from lib.commander import Commander
 from lib.temp_storage import TempStorage
+from lib.config_repository import ConfigRepository
 
 
 class Option82Info(base):
     __tablename__ = 'option82_infos'
+    __table_args__ = (
+        Index('ux_option82_infos_upstream', 'upstream_switch_mac', 'upstream_port_info', unique=True),
+        Index('ix_option82_infos_downstream_switch_mac', 'downstream_switch_mac'),
+    )
     id = Column(Integer, primary_key=True)
     upstream_switch_mac = Column(String, nullable=False, default=None)
     upstream_port_info = Column(String, nullable=False, default=None)
@@ -23,54 +31,118 @@ class Option82Info(base):
     downstream_switch_name = Column(String, nullable=True, default=None)
 
     def as_dict(self):
-        ret = {}
-        for col in self.__table__.columns:
-            val = getattr(self, col.name)
-            if isinstance(val, str):
-                ret[col.name] = val
-            elif isinstance(val, int):
-                ret[col.name] = val
-            elif isinstance(val, float):
-                ret[col.name] = val
-        return ret
+        return lib.db.as_dict(self)
 
 
 class Option82:
-    def __init__(self, commander: Commander, temp_storage: TempStorage):
+    def __init__(self, commander: Commander, temp_storage: TempStorage, config_repository: ConfigRepository):
         self._logger = logging.getLogger('option82')
         self._commander = commander
         self._temp_storage = temp_storage
+        self._config_repository = config_repository
+        self._by_upstream: typing.Dict[typing.Tuple[str, str], dict] = dict()
+        self._by_downstream: typing.Dict[str, typing.Set[typing.Tuple[str, str]]] = dict()
+        self._index_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.events_received = 0
+        self.events_processed = 0
+        self.events_collapsed = 0
+        self.events_invalid = 0
+        self.events_dropped = 0
+        self.batches = 0
 
-    def update_info(self, upstream_switch_mac, upstream_port_info, downstream_switch_mac):
+    def load(self):
         with sql_ses() as ses:
-            try:
-                info = ses.query(Option82Info).filter(
-                    and_(
-                        Option82Info.upstream_switch_mac == upstream_switch_mac,
-                        Option82Info.upstream_port_info == upstream_port_info
-                    )
-                ).one()
+            items = [info.as_dict() for info in ses.query(Option82Info)]
+        with self._index_lock:
+            self._by_upstream.clear()
+            self._by_downstream.clear()
+        for item in items:
+            self._index_put(item)
+        self._logger.info('loaded %s option82 entries', len(items))
 
-                old_mac_infos = ses.query(Option82Info).filter(
-                    and_(
-                        Option82Info.downstream_switch_mac == downstream_switch_mac,
-                        Option82Info.id != info.id
-                    )
-                ).all()
-                cleared_entries = 0
+    def _index_put(self, item: dict):
+        key = (item['upstream_switch_mac'], item['upstream_port_info'])
+        with self._index_lock:
+            self._index_discard(key)
+            self._by_upstream[key] = item
+            downstream_switch_mac = item.get('downstream_switch_mac')
+            if downstream_switch_mac is not None:
+                self._by_downstream.setdefault(downstream_switch_mac, set()).add(key)
+
+    def _index_discard(self, key):
+        old_item = self._by_upstream.pop(key, None)
+        if old_item is None:
+            return
+        old_downstream_switch_mac = old_item.get('downstream_switch_mac')
+        keys = self._by_downstream.get(old_downstream_switch_mac)
+        if keys is not None:
+            keys.discard(key)
+            if len(keys) == 0:
+                del self._by_downstream[old_downstream_switch_mac]
+
+    def _is_current(self, upstream_switch_mac, upstream_port_info, downstream_switch_mac) -> bool:
+        key = (upstream_switch_mac, upstream_port_info)
+        with self._index_lock:
+            item = self._by_upstream.get(key)
+            if item is None:
+                return True
+            return self._by_downstream.get(downstream_switch_mac) == {key}
+
+    def items(self) -> typing.List[dict]:
+        with self._index_lock:
+            items = [dict(item) for item in self._by_upstream.values()]
+        return sorted(items, key=lambda item: item['id'])
+
+    def by_downstream_switch_mac(self, downstream_switch_mac) -> typing.List[dict]:
+        with self._index_lock:
+            return [dict(self._by_upstream[key]) for key in self._by_downstream.get(downstream_switch_mac, ())]
+
+    def update_info(self, upstream_switch_mac, upstream_port_info, downstream_switch_mac):
+        self.apply_batch([(upstream_switch_mac, upstream_port_info, downstream_switch_mac)])
+
+    def apply_batch(self, events) -> bool:
+        # renewals that change nothing, and ports nobody has associated, never reach the database
+        events = [event for event in events if not self._is_current(*event)]
+        if len(events) == 0:
+            return True
+        upstream_switch_macs = set(event[0] for event in events)
+        downstream_switch_macs = set(event[2] for event in events)
+        committed = False
+        with self._write_lock, sql_ses() as ses:
+            by_upstream = {}
+            by_downstream = {}
+            for info in ses.query(Option82Info).filter(
+                or_(
+                    Option82Info.upstream_switch_mac.in_(upstream_switch_macs),
+                    Option82Info.downstream_switch_mac.in_(downstream_switch_macs)
+                )
+            ):
+                by_upstream[(info.upstream_switch_mac, info.upstream_port_info)] = info
+                if info.downstream_switch_mac is not None:
+                    by_downstream.setdefault(info.downstream_switch_mac, set()).add(info)
+
+            for upstream_switch_mac, upstream_port_info, downstream_switch_mac in events:
+                info = by_upstream.get((upstream_switch_mac, upstream_port_info))
+                if info is None:
+                    self._logger.info('no option82 info found for %s @ %s', upstream_switch_mac, upstream_port_info)
+                    continue
+
+                old_mac_infos = [
+                    old_mac_info for old_mac_info in by_downstream.get(downstream_switch_mac, set()) if old_mac_info is not info
+                ]
                 for old_mac_info in old_mac_infos:
                     old_mac_info.downstream_switch_mac = None
-                    ses.add(old_mac_info)
-                    cleared_entries += 1
+                    by_downstream[downstream_switch_mac].discard(old_mac_info)
                 if len(old_mac_infos) > 0:
-                    ses.commit()
-                    self._logger.info('cleared %s entries for %s', cleared_entries, downstream_switch_mac)
+                    self._logger.info('cleared %s entries for %s', len(old_mac_infos), downstream_switch_mac)
 
                 if info.downstream_switch_mac != downstream_switch_mac:
                     old_downstream_mac = info.downstream_switch_mac
+                    if old_downstream_mac is not None:
+                        by_downstream.get(old_downstream_mac, set()).discard(info)
                     info.downstream_switch_mac = downstream_switch_mac
-                    ses.add(info)
-                    ses.commit()
+                    by_downstream.setdefault(downstream_switch_mac, set()).add(info)
                     self._logger.info(
                         'updated downstream switch mac for %s @ %s (%s -> %s)',
                         info.upstream_switch_mac,
@@ -78,14 +150,22 @@ class Option82:
                         old_downstream_mac,
                         info.downstream_switch_mac
                     )
-            except sqlalchemy.orm.exc.NoResultFound:
-                self._logger.info('no option82 info found for %s @ %s', upstream_switch_mac, upstream_port_info)
+            changed = [info.as_dict() for info in ses.dirty]
+            if len(changed) > 0:
+                ses.commit()
+            for item in changed:
+                self._index_put(item)
+            committed = True
+        return committed
 
     def set_association(self, upstream_switch_mac, upstream_port_info, downstream_switch_name):
         upstream_port_info = upstream_port_info.lower()
         upstream_switch_mac = upstream_switch_mac.lower()
-        with sql_ses() as ses:
-            info = None
+        with self._index_lock:
+            item = self._by_upstream.get((upstream_switch_mac, upstream_port_info))
+            if item is not None and item.get('downstream_switch_name') == downstream_switch_name:
+                return dict(item)
+        with self._write_lock, sql_ses() as ses:
             try:
                 info = ses.query(Option82Info).filter(
                     and_(
@@ -119,13 +199,30 @@ class Option82:
                     upstream_switch_mac,
                     upstream_port_info
                 )
-            finally:
-                return info.as_dict()
+            # only committed rows reach the index, a failed commit propagates and leaves the index alone
+            item = info.as_dict()
+            self._index_put(item)
+            return dict(item)
+
+    def delete(self, item_id) -> bool:
+        with self._write_lock, sql_ses() as ses:
+            try:
+                info = ses.query(Option82Info).filter(Option82Info.id == item_id).one()
+            except sqlalchemy.orm.exc.NoResultFound:
+                return False
+            key = (info.upstream_switch_mac, info.upstream_port_info)
+            ses.delete(info)
+            ses.commit()
+            with self._index_lock:
+                self._index_discard(key)
+        return True
 
-    def _handle_message(self, message):
-        upstream_port_info = message.get('upstream_port_info', None).lower()
-        upstream_switch_mac = message.get('upstream_switch_mac', None).lower()
-        downstream_switch_mac = message.get('downstream_switch_mac', None).lower()
+    def _parse_event(self, message):
+        if not isinstance(message, dict):
+            return None
+        upstream_port_info = message.get('upstream_port_info', None)
+        upstream_switch_mac = message.get('upstream_switch_mac', None)
+        downstream_switch_mac = message.get('downstream_switch_mac', None)
         if upstream_port_info is None or upstream_switch_mac is None or downstream_switch_mac is None:
             self._logger.error(
                 'incomplete option82 data, ignoring (usm=%s, usp=%s, dsm=%s)',
@@ -133,34 +230,68 @@ class Option82:
                 upstream_port_info,
                 downstream_switch_mac
             )
-            return
-        self.update_info(upstream_switch_mac, upstream_port_info, downstream_switch_mac)
+            return None
+        return upstream_switch_mac.lower(), upstream_port_info.lower(), downstream_switch_mac.lower()
+
+    def _collect(self, batch: dict, payload: bytes):
+        try:
+            messages, _ = lib.wire.decode(payload)
+        except ValueError:
+            messages = None
+        if not isinstance(messages, list):
+            messages = [messages]
+        for message in messages:
+            self.events_received += 1
+            event = self._parse_event(message)
+            if event is None:
+                self.events_invalid += 1
+                continue
+            key = (event[0], event[1])
+            # only the latest lease per upstream port matters, keep events in arrival order
+            if batch.pop(key, None) is not None:
+                self.events_collapsed += 1
+            batch[key] = event
+
+    def stats(self):
+        return {
+            'received': self.events_received,
+            'processed': self.events_processed,
+            'collapsed': self.events_collapsed,
+            'invalid': self.events_invalid,
+            'dropped': self.events_dropped,
+            'batches': self.batches,
+        }
 
     def autoadopt(self, device):
-        ready_devices = None
-        association = None
-        with sql_ses() as ses:
-            try:
-                association = ses.query(Option82Info).filter(
-                    Option82Info.downstream_switch_mac == device.mac_address
-                ).one()
-            except sqlalchemy.orm.exc.NoResultFound:
-                association = None
-        if association is None:
+        adoption = self.resolve(device)
+        if adoption is None:
+            return
+        switch_name, switch_config, confighints = adoption
+        try:
+            self._commander.enqueue(
+                device,
+                tasks.DeviceConfigurationTask(
+                    device,
+                    identity=switch_name,
+                    configuration=switch_config,
+                    confighints=confighints,
+                    temp_storage=self._temp_storage
+                ),
+            )
+        except BaseException as e:
+            self._logger.error(e)
+
+    def resolve(self, device, neighbor_info=None):
+        associations = self.by_downstream_switch_mac(device.mac_address)
+        if len(associations) == 0:
             self._logger.info('opt82/%s: could not find association for %s', device.identifier, device.address)
             return
-        autoconf_path = config.get('liscain', 'autoconf_path')
-        whitelisted_prefixes = config.get('liscain', 'autoconf_version_whitelist_prefix')
-        version_ok = False
-        if whitelisted_prefixes is None:
-            version_ok = True
-        else:
-            whitelisted_prefixes = whitelisted_prefixes.split(',')
-            for whitelisted_prefix in whitelisted_prefixes:
-                if device.version.startswith(whitelisted_prefix):
-                    version_ok = True
-                    break
-        switch_name = association.downstream_switch_name
+        if len(associations) > 1:
+            self._logger.error('opt82/%s: more than 1 association for %s', device.identifier, device.mac_address)
+            return
+        association = associations[0]
+        version_ok = lib.config.current().version_allowed(device.version)
+        switch_name = association.get('downstream_switch_name')
         if not version_ok:
             self._logger.info(
                 'opt82/%s (%s @ %s) does not meet autoconf criteria (version)',
@@ -168,29 +299,28 @@ class Option82:
             )
             return
 
-        config_path = '{}/{}.cfg'.format(autoconf_path, switch_name)
         self._logger.info('opt82/%s: trying autoadopt for %s', device.identifier, switch_name)
-        switch_config = None
-        try:
-            with open(config_path) as fp:
-                switch_config = fp.read()
-        except FileNotFoundError:
-            self._logger.error('opt82/%s: failed to open %s for switch autoconfiguration', device.identifier, config_path)
+        switch_config = self._config_repository.get(switch_name)
+        if switch_config is None:
+            self._logger.error('opt82/%s: no config found for %s for switch autoconfiguration', device.identifier, switch_name)
             return
-        try:
-            self._commander.enqueue(
-                device,
-                tasks.DeviceConfigurationTask(device, identity=switch_name, configuration=switch_config, temp_storage=self._temp_storage),
-            )
-        except BaseException as e:
-            self._logger.error(e)
+        return switch_name, switch_config.text, switch_config.hints
 
     def autoadopt_mapping_listener(self, zmq_context):
+        settings = lib.config.current()
         zmq_socket = zmq_context.socket(zmq.PULL)
-        zmq_socket.bind(config.get('liscain', 'opt82_zmq_listener'))
+        zmq_socket.setsockopt(zmq.RCVHWM, settings.opt82_zmq_hwm)
+        zmq_socket.bind(settings.opt82_zmq_listener)
         while True:
-            try:
-                msg = zmq_socket.recv_json()
-                self._handle_message(msg)
-            except zmq.Again:
-                pass
+            batch = dict()
+            self._collect(batch, zmq_socket.recv())
+            for _ in range(1, lib.config.current().opt82_batch_max):
+                try:
+                    self._collect(batch, zmq_socket.recv(zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+            self.batches += 1
+            if self.apply_batch(batch.values()):
+                self.events_processed += len(batch)
+            else:
+                self.events_dropped += len(batch)
@@ -1,21 +1,96 @@
+import collections
 import uuid
 import threading
+import time
+import typing
+
+
+class TempStorageEntry:
+    __slots__ = ('data', 'size', 'expires', 'last_access', 'one_shot')
+
+    def __init__(self, data: str, expires: typing.Optional[float], one_shot: bool):
+        self.data = data
+        self.size = len(data.encode('utf-8'))
+        self.expires = expires
+        self.last_access = time.monotonic()
+        self.one_shot = one_shot
 
 
 class TempStorage:
-    def __init__(self):
-        self._data = {}
+    def __init__(self, ttl: float = 0, max_bytes: int = 0, one_shot: bool = False):
+        self._data: typing.Dict[str, TempStorageEntry] = {}
         self._data_lock = threading.Lock()
+        self._released: typing.Deque[int] = collections.deque()
+        self._size = 0
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._one_shot = one_shot
 
-    def store(self, data):
+    def store(self, data, ttl: typing.Optional[float] = None, one_shot: typing.Optional[bool] = None):
+        if ttl is None:
+            ttl = self._ttl
+        if one_shot is None:
+            one_shot = self._one_shot
+        expires = None
+        if ttl > 0:
+            expires = time.monotonic() + ttl
+        entry = TempStorageEntry(data, expires, one_shot)
         with self._data_lock:
+            self._reclaim()
             k = str(uuid.uuid4())
-            self._data[k] = data
+            self._data[k] = entry
+            self._size += entry.size
+            self._evict(k)
             return k
 
     def get(self, k):
-        with self._data_lock:
-            if k in self._data:
-                v = self._data[k]
-                return v
+        # read path is lock-free, writers only ever remove entries with dict.pop
+        entry = self._data.get(k)
+        if entry is None:
             return None
+        now = time.monotonic()
+        if entry.expires is not None and entry.expires <= now:
+            return None
+        if entry.one_shot:
+            if self._data.pop(k, None) is None:
+                return None
+            self._released.append(entry.size)
+            return entry.data
+        entry.last_access = now
+        return entry.data
+
+    def size(self):
+        with self._data_lock:
+            self._reclaim()
+            return self._size
+
+    def _reclaim(self):
+        while len(self._released) > 0:
+            self._size -= self._released.popleft()
+
+    def _remove(self, k):
+        entry = self._data.pop(k, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self, keep):
+        if self._max_bytes <= 0 or self._size <= self._max_bytes:
+            return
+        for k, entry in sorted(list(self._data.items()), key=lambda item: item[1].last_access):
+            if self._size <= self._max_bytes:
+                break
+            if k != keep:
+                self._remove(k)
+
+    def expire(self):
+        now = time.monotonic()
+        with self._data_lock:
+            self._reclaim()
+            for k, entry in list(self._data.items()):
+                if entry.expires is not None and entry.expires <= now:
+                    self._remove(k)
+
+    def expiry_loop(self, interval: float = 60):
+        while True:
+            time.sleep(interval)
+            self.expire()
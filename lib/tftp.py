@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import socket
+import struct
+import typing
+
+
+OP_RRQ = 1
+OP_WRQ = 2
+OP_DATA = 3
+OP_ACK = 4
+OP_ERROR = 5
+OP_OACK = 6
+
+ERR_NOT_DEFINED = 0
+ERR_FILE_NOT_FOUND = 1
+ERR_ACCESS_VIOLATION = 2
+ERR_ILLEGAL_OPERATION = 4
+ERR_UNKNOWN_TID = 5
+
+DEFAULT_BLKSIZE = 512
+MIN_BLKSIZE = 8
+MAX_BLKSIZE = 65464
+MAX_WINDOWSIZE = 65535
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+
+def error_packet(code: int, message: str) -> bytes:
+    return struct.pack('!HH', OP_ERROR, code) + message.encode('ascii') + b'\x00'
+
+
+def parse_request(packet: bytes) -> typing.Tuple[str, str, typing.Dict[str, str]]:
+    fields = packet[2:].split(b'\x00')
+    if len(fields) < 3:
+        raise ValueError('malformed request')
+    filename = fields[0].decode('ascii', errors='replace')
+    mode = fields[1].decode('ascii', errors='replace').lower()
+    options = {}
+    for index in range(2, len(fields) - 1, 2):
+        if index + 1 >= len(fields):
+            break
+        options[fields[index].decode('ascii', errors='replace').lower()] = fields[index + 1].decode('ascii', errors='replace')
+    return filename, mode, options
+
+
+class TftpTransfer(asyncio.DatagramProtocol):
+    def __init__(self, server: 'TftpServer', remote, data: bytes, blksize: int, windowsize: int, timeout: float,
+                 options: typing.Dict[str, str]):
+        self._server = server
+        self._remote = remote
+        self._data = data
+        self._blksize = blksize
+        self._windowsize = windowsize
+        self._timeout = timeout
+        self._options = options
+        self._last_block = len(data) // blksize + 1
+        self._base = 1 if len(options) == 0 else 0
+        self._retries = 0
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        self._transport: typing.Optional[asyncio.DatagramTransport] = None
+        self._finished = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._send_window()
+
+    def _block(self, block: int) -> bytes:
+        offset = (block - 1) * self._blksize
+        return struct.pack('!HH', OP_DATA, block % 65536) + self._data[offset:offset + self._blksize]
+
+    def _send_window(self):
+        if self._base == 0:
+            oack = struct.pack('!H', OP_OACK)
+            for key, value in self._options.items():
+                oack += key.encode('ascii') + b'\x00' + value.encode('ascii') + b'\x00'
+            self._transport.sendto(oack)
+        else:
+            for block in range(self._base, min(self._base + self._windowsize, self._last_block + 1)):
+                self._transport.sendto(self._block(block))
+        self._arm_timer()
+
+    def _arm_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self._timeout, self._on_timeout)
+
+    def _on_timeout(self):
+        self._retries += 1
+        if self._retries > self._server.retries:
+            self._server.logger.info('tftp: transfer to %s timed out', self._remote[0])
+            self._finish(False)
+            return
+        self._send_window()
+
+    def _finish(self, success: bool):
+        if self._finished:
+            return
+        self._finished = True
+        if self._timer is not None:
+            self._timer.cancel()
+        self._transport.close()
+        self._server.transfer_done(success, len(self._data))
+
+    def datagram_received(self, packet, addr):
+        if len(packet) < 4:
+            return
+        opcode, block = struct.unpack('!HH', packet[:4])
+        if opcode == OP_ERROR:
+            self._finish(False)
+            return
+        if opcode != OP_ACK:
+            self._transport.sendto(error_packet(ERR_ILLEGAL_OPERATION, 'unexpected packet'))
+            self._finish(False)
+            return
+        # map the 16-bit block number back onto the window that is in flight, a duplicate ack of the block before
+        # it is ignored rather than answered with the window again (sorcerer's apprentice), the timer resends
+        acked = None
+        for candidate in range(self._base + self._windowsize - 1, self._base - 1, -1):
+            if candidate >= 0 and candidate % 65536 == block:
+                acked = candidate
+                break
+        if acked is None:
+            return
+        if acked >= self._last_block:
+            self._finish(True)
+            return
+        self._retries = 0
+        self._base = acked + 1
+        self._send_window()
+
+    def error_received(self, exc):
+        self._finish(False)
+
+    def connection_lost(self, exc):
+        if not self._finished:
+            self._finish(False)
+
+
+class TftpServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: 'TftpServer'):
+        self._server = server
+        self._transport: typing.Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, packet, addr):
+        if len(packet) < 2:
+            return
+        opcode, = struct.unpack('!H', packet[:2])
+        if opcode == OP_RRQ:
+            try:
+                filename, mode, options = parse_request(packet)
+            except ValueError:
+                self._transport.sendto(error_packet(ERR_ILLEGAL_OPERATION, 'malformed request'), addr)
+                return
+            asyncio.get_running_loop().create_task(self._server.start_transfer(filename, options, addr))
+        elif opcode == OP_WRQ:
+            self._transport.sendto(error_packet(ERR_ACCESS_VIOLATION, 'write not supported'), addr)
+        else:
+            self._transport.sendto(error_packet(ERR_ILLEGAL_OPERATION, 'unexpected packet'), addr)
+
+
+class TftpServer:
+    def __init__(self, dyn_file_func, host: str = '', port: int = 69, timeout: float = 2, retries: int = 5,
+                 max_blksize: int = MAX_BLKSIZE, max_windowsize: int = 64):
+        self.logger = logging.getLogger('tftp')
+        self._dyn_file_func = dyn_file_func
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self.retries = retries
+        self._max_blksize = max_blksize
+        self._max_windowsize = max_windowsize
+        self._transport: typing.Optional[asyncio.DatagramTransport] = None
+        self.active_transfers = 0
+        self.transfers_completed = 0
+        self.transfers_failed = 0
+        self.bytes_sent = 0
+
+    @property
+    def port(self) -> int:
+        if self._transport is None:
+            return self._port
+        return self._transport.get_extra_info('sockname')[1]
+
+    def _read_file(self, filename: str, addr) -> typing.Optional[bytes]:
+        fileobj = self._dyn_file_func(filename, raddress=addr[0], rport=addr[1])
+        if fileobj is None:
+            return None
+        data = fileobj.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return data
+
+    def _negotiate(self, options: typing.Dict[str, str], size: int):
+        blksize = DEFAULT_BLKSIZE
+        windowsize = 1
+        timeout = self._timeout
+        accepted = {}
+        try:
+            # the answer may only lower a requested value, options below the valid range are left unacknowledged
+            if 'blksize' in options and int(options['blksize']) >= MIN_BLKSIZE:
+                blksize = min(int(options['blksize']), self._max_blksize)
+                accepted['blksize'] = str(blksize)
+            if 'windowsize' in options and int(options['windowsize']) >= 1:
+                windowsize = min(int(options['windowsize']), self._max_windowsize)
+                accepted['windowsize'] = str(windowsize)
+            if 'timeout' in options and 1 <= int(options['timeout']) <= 255:
+                timeout = int(options['timeout'])
+                accepted['timeout'] = options['timeout']
+            if 'tsize' in options:
+                accepted['tsize'] = str(size)
+        except ValueError:
+            pass
+        return blksize, windowsize, timeout, accepted
+
+    async def start_transfer(self, filename: str, options: typing.Dict[str, str], addr):
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, self._read_file, filename, addr)
+        except Exception as e:
+            self.logger.error('tftp: failed to serve %s to %s: %s', filename, addr[0], e)
+            data = None
+        if data is None:
+            self._transport.sendto(error_packet(ERR_FILE_NOT_FOUND, 'file not found'), addr)
+            return
+        blksize, windowsize, timeout, accepted = self._negotiate(options, len(data))
+        self.active_transfers += 1
+        try:
+            await loop.create_datagram_endpoint(
+                lambda: TftpTransfer(self, addr, data, blksize, windowsize, timeout, accepted),
+                local_addr=(self._host or '0.0.0.0', 0),
+                remote_addr=addr,
+            )
+        except OSError as e:
+            self.logger.error('tftp: failed to start transfer of %s to %s: %s', filename, addr[0], e)
+            self.transfer_done(False, 0)
+
+    def transfer_done(self, success: bool, size: int):
+        self.active_transfers -= 1
+        if success:
+            self.transfers_completed += 1
+            self.bytes_sent += size
+        else:
+            self.transfers_failed += 1
+
+    async def start(self):
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: TftpServerProtocol(self),
+            local_addr=(self._host or '0.0.0.0', self._port),
+        )
+        # a boot storm sends hundreds of requests at once, don't drop them in the kernel
+        try:
+            self._transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError:
+            pass
+
+    def stop(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def listen(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start())
+        loop.run_forever()
@@ -0,0 +1,120 @@
+import collections
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+
+# the optional digit is the encryption type (0, 5, 7, ...), the word after it is the credential
+RE_SECRET = re.compile(
+    r'\b(password|secret|key-string|community|authentication-key\s+\d+\s+md5'
+    r'|key(?!\s+(?:generate|zeroize|chain|config-key|storage|import|export|pubkey-chain)\b)'
+    r'|auth\s+(?:md5|sha\S*)|priv\s+(?:des56|des|3des|aes\s+\d+))(\s+\d)?\s+\S+',
+    re.IGNORECASE
+)
+REDACTED = '<redacted>'
+
+_task_span: contextvars.ContextVar = contextvars.ContextVar('trace_task_span', default=None)
+
+
+def redact(command: typing.Optional[str]) -> typing.Optional[str]:
+    if command is None:
+        return None
+    return RE_SECRET.sub(lambda match: '{}{} {}'.format(match.group(1), match.group(2) or '', REDACTED), command)
+
+
+class Tracer:
+    def __init__(self, ring_size: int = 256, max_devices: int = 4096):
+        self._logger = logging.getLogger('trace')
+        self._export_logger = logging.getLogger('trace-export')
+        self._export_logger.propagate = False
+        self._export_logger.setLevel(logging.INFO)
+        self._listener: typing.Optional[logging.handlers.QueueListener] = None
+        self._rings: typing.OrderedDict[int, typing.Deque[dict]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.ring_size = ring_size
+        self.max_devices = max_devices
+
+    def open(self, path: str, max_bytes: int, backup_count: int):
+        # spans are recorded on the telnet event loop, rotation and disk writes happen on the listener thread
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        span_queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(span_queue, file_handler)
+        self._listener.start()
+        self._export_logger.addHandler(logging.handlers.QueueHandler(span_queue))
+        self._logger.info('writing spans to %s', path)
+
+    def record(self, span: dict):
+        device_id = span.get('device')
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                ring = collections.deque(maxlen=self.ring_size)
+                self._rings[device_id] = ring
+                while len(self._rings) > self.max_devices:
+                    self._rings.popitem(last=False)
+            else:
+                self._rings.move_to_end(device_id)
+            ring.append(span)
+        if self._listener is not None:
+            self._export_logger.info(json.dumps(span))
+
+    def spans(self, device_id: int, limit: typing.Optional[int] = None) -> typing.List[dict]:
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                return []
+            spans = list(ring)
+        if limit is not None and limit > 0:
+            spans = spans[-limit:]
+        return spans
+
+    @contextmanager
+    def _span(self, kind: str, device_id: int, name: typing.Optional[str], **fields):
+        span = {
+            'id': next(self._ids),
+            'kind': kind,
+            'device': device_id,
+            'name': name,
+            'start': round(time.time(), 3),
+        }
+        span.update(fields)
+        started = time.monotonic()
+        try:
+            yield span
+        except BaseException as e:
+            span['error'] = str(e) or e.__class__.__name__
+            raise
+        finally:
+            span['elapsed'] = round(time.monotonic() - started, 6)
+            self.record(span)
+
+    @contextmanager
+    def task(self, device_id: int, name: str):
+        with self._span('task', device_id, name) as span:
+            token = _task_span.set(span['id'])
+            try:
+                yield span
+            finally:
+                _task_span.reset(token)
+
+    def command(self, device_id: int, command: typing.Optional[str], secret: bool = False):
+        return self._span(
+            'command',
+            device_id,
+            REDACTED if secret and command is not None else redact(command),
+            task=_task_span.get(),
+            bytes_out=0,
+            bytes_in=0,
+        )
+
+
+tracer = Tracer()
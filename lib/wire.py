@@ -0,0 +1,47 @@
+import json
+import typing
+import zmq
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+
+def encodings() -> typing.List[str]:
+    if msgpack is None:
+        return [JSON]
+    return [JSON, MSGPACK]
+
+
+def encode(obj, encoding: str = JSON) -> bytes:
+    if encoding == MSGPACK:
+        if msgpack is None:
+            raise ValueError('msgpack encoding requested but msgpack is not installed')
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj).encode('utf-8')
+
+
+def decode(payload: bytes) -> typing.Tuple[typing.Any, str]:
+    # json documents start with printable ascii, msgpack maps and arrays never do
+    if len(payload) > 0 and payload[0] >= 0x80:
+        if msgpack is None:
+            raise ValueError('received msgpack payload but msgpack is not installed')
+        try:
+            return msgpack.unpackb(payload, raw=False), MSGPACK
+        except msgpack.UnpackException as e:
+            raise ValueError('malformed msgpack payload: {}'.format(e))
+    return json.loads(payload), JSON
+
+
+def send(zmq_socket: zmq.Socket, obj, encoding: str = JSON):
+    zmq_socket.send(encode(obj, encoding))
+
+
+def recv(zmq_socket: zmq.Socket):
+    obj, _ = decode(zmq_socket.recv())
+    return obj
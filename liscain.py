@@ -3,7 +3,11 @@ import tftpy
 import logging
 import ipaddress
 import threading
+import signal
 import lib.db
+import lib.metrics
+import lib.tftp
+import lib.trace
 import sqlalchemy.orm
 import tasks
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
@@ -13,12 +17,16 @@ from devices import remap_to_subclass
 from devices.device import Device
 from devices.ciscoios import CiscoIOS
 from io import StringIO
-from lib.config import config
+import lib.config
 from lib.switchstate import SwitchState
 from lib.option82 import Option82
 from lib.cdp_adopter import CDPAdopter
 from lib.commander import Commander
 from lib.temp_storage import TempStorage
+from lib.coalescer import RequestCoalescer
+from lib.command_server import CommandServer
+from lib.jobs import NeighborInfoJobs
+from lib.config_repository import ConfigRepository
 import zmq
 
 
@@ -33,13 +41,97 @@ logging.getLogger('tftpy.TftpPacketTypes').setLevel(logging.CRITICAL)
 logging.getLogger('tftpy.TftpStates').setLevel(logging.CRITICAL)
 
 
-commander: Commander = Commander()
+settings: lib.config.Settings = lib.config.current()
+
+commander: Commander = Commander(settings.commander_pool_size)
 commander.start()
 
-temp_storage: lib.temp_storage.TempStorage = TempStorage()
+temp_storage: lib.temp_storage.TempStorage = TempStorage(
+    ttl=settings.temp_storage_ttl,
+    max_bytes=settings.temp_storage_max_bytes,
+    one_shot=settings.temp_storage_one_shot,
+)
+
+boot_coalescer: RequestCoalescer = RequestCoalescer(settings.tftp_coalesce_ttl)
+
+neighbor_info_jobs: NeighborInfoJobs = NeighborInfoJobs(
+    ttl=settings.neighbor_info_ttl,
+    workers=settings.neighbor_info_workers,
+)
+
+config_repository: ConfigRepository = ConfigRepository(
+    settings.autoconf_path,
+    poll_interval=settings.autoconf_poll_interval,
+)
+
+cdp_adopter: lib.cdp_adopter.CDPAdopter = lib.cdp_adopter.CDPAdopter(commander, temp_storage, config_repository)
+option82_controller: lib.option82.Option82 = lib.option82.Option82(commander, temp_storage, config_repository)
+
+files_served = lib.metrics.Counter('liscain_files_served_total', 'Files served to switches', ['protocol'])
+bytes_sent = lib.metrics.Counter('liscain_bytes_sent_total', 'Bytes of files served to switches', ['protocol'])
+lib.metrics.Gauge('liscain_commander_queue_depth', 'Tasks queued or running').set_function(commander.queue_depth)
+lib.metrics.Gauge('liscain_commander_active_workers', 'Devices with a task running').set_function(
+    commander.active_workers
+)
+opt82_events = lib.metrics.Counter('liscain_opt82_events_total', 'Option82 events by outcome', ['result'])
+for opt82_result in ('received', 'processed', 'collapsed', 'invalid', 'dropped'):
+    opt82_events.labels(opt82_result).set_function(
+        lambda opt82_result=opt82_result: getattr(option82_controller, 'events_{}'.format(opt82_result))
+    )
+
+
+def init_task(device: Device, adopter) -> tasks.DeviceInitializationTask:
+    if adopter is None:
+        return tasks.DeviceInitializationTask(device)
+    if lib.config.current().autoconf_single_session:
+        return tasks.DeviceInitializationTask(device, adopter=adopter, temp_storage=temp_storage)
+    task = tasks.DeviceInitializationTask(device)
+    task.hook(SwitchState.READY, adopter.autoadopt)
+    return task
 
-cdp_adopter: lib.cdp_adopter.CDPAdopter = lib.cdp_adopter.CDPAdopter(commander, temp_storage)
-option82_controller: lib.option82.Option82 = lib.option82.Option82(commander, temp_storage)
+
+def current_adopter():
+    settings = lib.config.current()
+    if not settings.autoconf_enabled:
+        return None
+    if settings.autoconf_mode == 'cdp':
+        return cdp_adopter
+    if settings.autoconf_mode == 'opt82':
+        return option82_controller
+    return None
+
+
+def boot_config(remote_address: str, remote_id: str) -> str:
+    global commander
+    global cdp_adopter
+    global option82_controller
+
+    device = None
+    with lib.db.sql_ses() as ses:
+        try:
+            device = ses.query(CiscoIOS).filter(
+                and_(
+                    CiscoIOS.identifier == remote_id,
+                    CiscoIOS.state != SwitchState.CONFIGURED
+                )
+            ).one()
+        except sqlalchemy.orm.exc.NoResultFound:
+            device = CiscoIOS()
+            device.initialize(identifier=remote_id, address=remote_address)
+            ses.add(device)
+            ses.commit()
+            ses.refresh(device)
+    try:
+        commander.enqueue(device, init_task(device, current_adopter()))
+    except KeyError as e:
+        logger.error('init/%s: %s', remote_id, e)
+    return device.emit_base_config().getvalue()
+
+
+def served(protocol: str, data: str) -> str:
+    files_served.labels(protocol).inc()
+    bytes_sent.labels(protocol).inc(len(data.encode('utf-8')))
+    return data
 
 
 def serve_file(name: str, **kwargs) -> StringIO:
@@ -47,6 +139,7 @@ def serve_file(name: str, **kwargs) -> StringIO:
     global cdp_adopter
     global option82_controller
     global temp_storage
+    global boot_coalescer
 
     remote_address: str = kwargs['raddress']
     remote_id: str = 'lc-{:02x}'.format(int(ipaddress.ip_address(remote_address)))
@@ -56,50 +149,85 @@ def serve_file(name: str, **kwargs) -> StringIO:
     if len(filepath.parts) == 2 and filepath.parts[0] == 'adopt':
         storage_data = temp_storage.get(filepath.name)
         if storage_data is not None:
-            return StringIO(storage_data)
+            return StringIO(served('tftp', storage_data))
     elif name in ['network-confg', 'switch-confg']:
-        device = None
-        with lib.db.sql_ses() as ses:
-            try:
-                device = ses.query(CiscoIOS).filter(
-                    and_(
-                        CiscoIOS.identifier == remote_id,
-                        CiscoIOS.state != SwitchState.CONFIGURED
-                    )
-                ).one()
-            except sqlalchemy.orm.exc.NoResultFound:
-                device = CiscoIOS()
-                device.initialize(identifier=remote_id, address=remote_address)
-                ses.add(device)
-                ses.commit()
-                ses.refresh(device)
-        try:
-            task = tasks.DeviceInitializationTask(device)
-            if config.get('liscain', 'autoconf_enabled') == 'yes':
-                autoconf_mode = None
-                try:
-                    autoconf_mode = config.get('liscain', 'autoconf_mode')
-                except Exception:
-                    logger.error("init/%s: failed to get autoconf_mode (is autoconf_mode set in config?)", remote_id)
-                if autoconf_mode == 'cdp':
-                    task.hook(SwitchState.READY, cdp_adopter.autoadopt)
-                elif autoconf_mode == 'opt82':
-                    task.hook(SwitchState.READY, option82_controller.autoadopt)
-            commander.enqueue(device, task)
-        except KeyError as e:
-            logger.error('init/%s: %s', remote_id, e)
-        return device.emit_base_config()
+        return StringIO(served(
+            'tftp',
+            boot_coalescer.get_or_compute(remote_address, lambda: boot_config(remote_address, remote_id))
+        ))
     else:
         logger.debug('%s requested %s, ignoring', remote_id, name)
     return StringIO()
 
 
 def tftp_server():
+    if settings.tftp_server == 'builtin':
+        srv = lib.tftp.TftpServer(
+            serve_file,
+            port=settings.tftp_port,
+            max_windowsize=settings.tftp_max_windowsize,
+        )
+        srv.listen()
+        return
     with tempfile.TemporaryDirectory() as td:
         srv = tftpy.TftpServer(tftproot=td, dyn_file_func=serve_file)
         srv.listen()
 
 
+def list_devices(message):
+    columns = Device.__table__.columns
+    fields = message.get('fields', None)
+    if fields is None:
+        fields = [column.name for column in columns] + ['cqueue']
+    unknown_fields = [field for field in fields if field != 'cqueue' and field not in columns]
+    if len(unknown_fields) > 0:
+        return {'error': 'unknown fields: {}'.format(', '.join(unknown_fields))}
+    selected = [columns[field] for field in fields if field != 'cqueue']
+    if 'cqueue' in fields and 'id' not in fields:
+        selected.append(columns['id'])
+
+    filters = []
+    for key, negate in (('states', False), ('exclude_states', True)):
+        states = message.get(key, None)
+        if states is None:
+            continue
+        try:
+            states = [SwitchState[state] for state in states]
+        except KeyError as e:
+            return {'error': 'unknown state {}'.format(e)}
+        filters.append(Device.state.notin_(states) if negate else Device.state.in_(states))
+    if message.get('prefix', None) is not None:
+        filters.append(Device.identifier.startswith(message['prefix'], autoescape=True))
+    if message.get('mac', None) is not None:
+        filters.append(
+            sqlalchemy.func.replace(Device.mac_address, ':', '').contains(message['mac'].replace(':', ''), autoescape=True)
+        )
+    if message.get('after_id', None) is not None:
+        filters.append(Device.id > message['after_id'])
+
+    queue_lengths = commander.queue_lengths() if 'cqueue' in fields else None
+    ret = []
+    with lib.db.sql_ses() as ses:
+        query = ses.query(*selected).filter(*filters).order_by(Device.id)
+        if message.get('offset', None) is not None:
+            query = query.offset(message['offset'])
+        if message.get('limit', None) is not None:
+            query = query.limit(message['limit'])
+        for row in query:
+            device_dict = {}
+            for column, val in zip(selected, row):
+                if isinstance(val, SwitchState):
+                    device_dict[column.name] = str(val)
+                elif val is not None:
+                    device_dict[column.name] = val
+            if queue_lengths is not None:
+                device_dict['cqueue'] = queue_lengths.get(device_dict['id'], 0)
+                if 'id' not in fields:
+                    del device_dict['id']
+            ret.append(device_dict)
+    return ret
+
+
 def handle_msg(message):
     global option82_controller
     global cdp_adopter
@@ -107,15 +235,7 @@ def handle_msg(message):
 
     cmd = message.get('cmd', None)
     if cmd == 'list':
-        ret = []
-        with lib.db.sql_ses() as ses:
-            devices = ses.query(Device).all()
-            for device in devices:
-                queued_commands = len(commander.get_queue_list(device))
-                device_dict = device.as_dict()
-                device_dict['cqueue'] = queued_commands
-                ret.append(device_dict)
-        return ret
+        return list_devices(message)
 
     elif cmd == 'neighbor-info':
         device_id = message.get('id', None)
@@ -125,10 +245,19 @@ def handle_msg(message):
             try:
                 device = ses.query(Device).filter(Device.id == device_id).one()
                 remap_to_subclass(device)
-                return {'info': device.neighbor_info()}
+                return neighbor_info_jobs.submit(device, bool(message.get('full', False)))
             except sqlalchemy.orm.exc.NoResultFound:
                 return {'error': 'device not found'}
 
+    elif cmd == 'job':
+        job_id = message.get('id', None)
+        if job_id is None:
+            return {'error': 'missing job id'}
+        job = neighbor_info_jobs.get(job_id)
+        if job is None:
+            return {'error': 'job not found'}
+        return job
+
     elif cmd == 'delete':
         device_id = message.get('id', None)
         if device_id is None:
@@ -161,12 +290,17 @@ def handle_msg(message):
         device_id = message.get('id', None)
         switch_config = message.get('config', None)
         identity = message.get('identity', None)
+        confighints = None
         if device_id is None:
             return {'error': 'missing device id'}
-        if config is None:
-            return {'error': 'missing config'}
         if identity is None:
             return {'error': 'missing identity'}
+        if switch_config is None:
+            repository_config = config_repository.get(identity)
+            if repository_config is None:
+                return {'error': 'missing config, and no config for {} in autoconf path'.format(identity)}
+            switch_config = repository_config.text
+            confighints = repository_config.hints
         device = None
         with lib.db.sql_ses() as ses:
             try:
@@ -177,7 +311,13 @@ def handle_msg(message):
         try:
             commander.enqueue(
                 device,
-                tasks.DeviceConfigurationTask(device, identity=identity, configuration=switch_config, temp_storage=temp_storage)
+                tasks.DeviceConfigurationTask(
+                    device,
+                    identity=identity,
+                    configuration=switch_config,
+                    confighints=confighints,
+                    temp_storage=temp_storage
+                )
             )
             return {'info': 'ok'}
         except BaseException as e:
@@ -195,20 +335,28 @@ def handle_msg(message):
                 return {'error': 'device not found'}
         remap_to_subclass(device)
         try:
-            task = tasks.DeviceInitializationTask(device)
-            if config.get('liscain', 'autoconf_enabled') == 'yes':
-                if config.get('liscain', 'autoconf_mode') == 'cdp':
-                    task.hook(SwitchState.READY, cdp_adopter.autoadopt)
-                if config.get('liscain', 'autoconf_mode') == 'opt82':
-                    task.hook(SwitchState.READY, option82_controller.autoadopt)
             commander.enqueue(
                 device,
-                task
+                init_task(device, current_adopter())
             )
             return {'info': 'ok'}
         except BaseException as e:
             return {'error': str(e)}
 
+    elif cmd == 'trace':
+        device_id = message.get('id', None)
+        if device_id is None:
+            return {'error': 'missing device id'}
+        return lib.trace.tracer.spans(device_id, message.get('limit', None))
+
+    elif cmd == 'stats':
+        return {
+            'boot_coalescer': boot_coalescer.stats(),
+            'jaspy': cdp_adopter.jaspy.stats(),
+            'option82': option82_controller.stats(),
+            'config_repository': config_repository.stats(),
+        }
+
     elif cmd == 'opt82-info':
         upstream_switch_mac = message.get('upstream_switch_mac', None)
         upstream_port_info = message.get('upstream_port_info', None)
@@ -218,26 +366,19 @@ def handle_msg(message):
         if upstream_port_info is None:
             return {'error': 'missing upstream port info'}
         info = option82_controller.set_association(upstream_switch_mac, upstream_port_info, downstream_switch_name)
+        if info is None:
+            return {'error': 'failed to store option82 association'}
         return info
 
     elif cmd == 'opt82-list':
-        opt82_items = []
-        with lib.db.sql_ses() as ses:
-            for option82_item in ses.query(lib.option82.Option82Info).all():
-                opt82_items.append(option82_item.as_dict())
-        return opt82_items
+        return option82_controller.items()
 
     elif cmd == 'opt82-delete':
         item_id = message.get('id', None)
         if item_id is None:
             return {'error': 'missing opt82 item id'}
-        with lib.db.sql_ses() as ses:
-            try:
-                opt82_item = ses.query(lib.option82.Option82Info).filter(lib.option82.Option82Info.id == item_id).one()
-                ses.delete(opt82_item)
-                ses.commit()
-            except sqlalchemy.orm.exc.NoResultFound:
-                return {'error': 'option82 item not found'}
+        if not option82_controller.delete(item_id):
+            return {'error': 'option82 item not found'}
         return {'info': 'option82 info deleted'}
 
     return {'error': 'unknown command'}
@@ -247,6 +388,15 @@ class LiscainHTTPRequestHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         global temp_storage
 
+        if self.path == '/metrics':
+            body = lib.metrics.REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', lib.metrics.CONTENT_TYPE)
+            self.send_header('Content-length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
         filepath = Path(self.path.strip('/'))
         if len(filepath.parts) == 2 and filepath.parts[0] == 'adopt':
             storage_data = temp_storage.get(filepath.name)
@@ -254,7 +404,7 @@ class LiscainHTTPRequestHandler(BaseHTTPRequestHandler):
                 self.send_response(200)
                 self.send_header('Content-type', 'text/plain')
                 self.end_headers()
-                self.wfile.write(storage_data.encode('utf-8'))
+                self.wfile.write(served('http', storage_data).encode('utf-8'))
                 return
 
         self.send_response(404)
@@ -264,26 +414,36 @@ class LiscainHTTPRequestHandler(BaseHTTPRequestHandler):
 
 
 def http_server_startup():
-    server_address = ('', config.getint("liscain", "http_port"))
+    server_address = ('', settings.http_port)
     httpd = ThreadingHTTPServer(server_address, LiscainHTTPRequestHandler)
     httpd.serve_forever()
 
 
+def reload_settings(signum, frame):
+    threading.Thread(target=lib.config.reload, daemon=True).start()
+
+
 def main():
     global option82_controller
 
-    lib.db.initialize(config.get('liscain', 'database'))
+    signal.signal(signal.SIGHUP, reload_settings)
+    lib.trace.tracer.ring_size = settings.trace_ring_size
+    if settings.trace_file is not None:
+        lib.trace.tracer.open(settings.trace_file, settings.trace_max_bytes, settings.trace_backup_count)
+    lib.db.initialize(settings.database)
+    option82_controller.load()
+    config_repository.load()
+    config_repository_watch: threading.Thread = threading.Thread(target=config_repository.watch, daemon=True)
+    config_repository_watch.start()
     tftp_task: threading.Thread = threading.Thread(target=tftp_server, daemon=True)
     tftp_task.start()
 
     http_task = None
-    if config.getboolean("liscain", "serve_http", fallback=False):
+    if settings.serve_http:
         http_task: threading.Thread = threading.Thread(target=http_server_startup, daemon=True)
         http_task.start()
 
     zmq_context: zmq.Context = zmq.Context(10)
-    zmq_sock: zmq.socket = zmq_context.socket(zmq.REP)
-    zmq_sock.bind(config.get('liscain', 'command_socket'))
 
     option82_controller_autoadopt: threading.Thread = threading.Thread(
         target=option82_controller.autoadopt_mapping_listener,
@@ -292,9 +452,16 @@ def main():
     )
     option82_controller_autoadopt.start()
 
-    while True:
-        msg: dict = zmq_sock.recv_json()
-        zmq_sock.send_json(handle_msg(msg))
+    temp_storage_expiry: threading.Thread = threading.Thread(target=temp_storage.expiry_loop, daemon=True)
+    temp_storage_expiry.start()
+
+    command_server: CommandServer = CommandServer(
+        zmq_context,
+        settings.command_socket,
+        handle_msg,
+        workers=settings.command_workers,
+    )
+    command_server.serve_forever()
 
 
 if __name__ == '__main__':
@@ -1,21 +1,107 @@
 import zmq
 import argparse
+import json
+import queue
+import sys
+import threading
+
+
+def parse_line(line):
+    line = line.strip()
+    if len(line) == 0:
+        return None
+    if line.startswith('{'):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(event, dict):
+            return None
+        return event
+    fields = line.split()
+    if len(fields) != 3:
+        return None
+    return {
+        'upstream_switch_mac': fields[0],
+        'upstream_port_info': fields[1],
+        'downstream_switch_mac': fields[2]
+    }
+
+
+def read_events(events, fifo):
+    while True:
+        fp = sys.stdin if fifo is None else open(fifo)
+        for line in fp:
+            event = parse_line(line)
+            if event is None:
+                sys.stderr.write('ignoring malformed event: {}\n'.format(line.strip()))
+                continue
+            events.put(event)
+        if fifo is None:
+            break
+        # every writer has closed the pipe, wait for the next one
+        fp.close()
+    events.put(None)
+
+
+def encode(obj, encoding):
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj).encode('utf-8')
+
+
+def stream(zmq_socket, fifo, batch_size, linger, encoding):
+    events = queue.Queue()
+    threading.Thread(target=read_events, args=(events, fifo), daemon=True).start()
+    running = True
+    while running:
+        event = events.get()
+        if event is None:
+            break
+        batch = [event]
+        while len(batch) < batch_size:
+            try:
+                event = events.get(timeout=linger)
+            except queue.Empty:
+                break
+            if event is None:
+                running = False
+                break
+            batch.append(event)
+        zmq_socket.send(encode(batch, encoding))
 
 
 parser = argparse.ArgumentParser(description='liscain-opt82-hook')
-parser.add_argument('-M', '--upstream-switch-mac', required=True, help='upstream switch mac', default=None)
-parser.add_argument('-P', '--upstream-port-info', required=True, help='upstream switch port', default=None)
-parser.add_argument('-m', '--downstream-switch-mac', required=True, help='downstream switch mac', default=None)
+parser.add_argument('-M', '--upstream-switch-mac', required=False, help='upstream switch mac', default=None)
+parser.add_argument('-P', '--upstream-port-info', required=False, help='upstream switch port', default=None)
+parser.add_argument('-m', '--downstream-switch-mac', required=False, help='downstream switch mac', default=None)
 parser.add_argument('-z', '--zmq-socket', required=True, help='zmq-socket', default=None)
+parser.add_argument('-s', '--stream', required=False, help='read events from stdin, one per line (json or "usm usp dsm")', default=False, action='store_true')
+parser.add_argument('-f', '--fifo', required=False, help='read events from this named pipe instead of stdin (implies --stream)', default=None)
+parser.add_argument('-b', '--batch-size', required=False, help='maximum events per message in stream mode', type=int, default=100)
+parser.add_argument('-e', '--encoding', required=False, help='message encoding', choices=['json', 'msgpack'], default='json')
+parser.add_argument('-l', '--linger', required=False, help='milliseconds to wait for more events before sending a batch', type=float, default=10)
 args = parser.parse_args()
 
+streaming = args.stream or args.fifo is not None
+if not streaming and None in (args.upstream_switch_mac, args.upstream_port_info, args.downstream_switch_mac):
+    parser.error('-M, -P and -m are required unless streaming')
+
 c = zmq.Context()
 s = c.socket(zmq.PUSH)
 s.connect(args.zmq_socket)
-s.send_json(
-    {
-        'upstream_switch_mac': args.upstream_switch_mac,
-        'upstream_port_info': args.upstream_port_info,
-        'downstream_switch_mac': args.downstream_switch_mac
-    }
-)
+if streaming:
+    try:
+        stream(s, args.fifo, args.batch_size, args.linger / 1000, args.encoding)
+    except KeyboardInterrupt:
+        pass
+else:
+    s.send(encode(
+        {
+            'upstream_switch_mac': args.upstream_switch_mac,
+            'upstream_port_info': args.upstream_port_info,
+            'downstream_switch_mac': args.downstream_switch_mac
+        },
+        args.encoding
+    ))
@@ -19,7 +19,7 @@ class DeviceConfigurationTask(tasks.devicetask.DeviceTask):
             self._device.change_state(SwitchState.CONFIGURE_FAILED)
             self._logger.info('identity setup failed')
             return
-        if not self._device.configure(self._args.get('configuration'), self._args.get('temp_storage')):
+        if not self._device.configure(self._args.get('configuration'), self._args.get('temp_storage'), self._args.get('confighints')):
             self._device.change_state(SwitchState.CONFIGURE_FAILED)
             self._logger.info('configuration failed')
             return
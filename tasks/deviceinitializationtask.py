@@ -15,9 +15,31 @@ class DeviceInitializationTask(DeviceTask):
     def run(self):
         self._logger.info('start initialization')
         self._device.change_state(SwitchState.INIT)
+        if self._args.get('adopter') is not None:
+            self._run_with_adopter()
+            return
         if not self._device.initial_setup():
             self._device.change_state(SwitchState.INIT_FAILED)
             self._logger.info('initialization failed')
             return
         self._device.change_state(SwitchState.READY)
         self._logger.info('initialization complete')
+
+    def _ready(self, neighbor_info):
+        self._device.change_state(SwitchState.READY)
+        self._logger.info('initialization complete')
+        return self._args.get('adopter').resolve(self._device, neighbor_info)
+
+    def _run_with_adopter(self):
+        state = self._device.initial_setup_and_adopt(self._ready, self._args.get('temp_storage'))
+        if state == SwitchState.INIT_FAILED:
+            self._device.change_state(SwitchState.INIT_FAILED)
+            self._logger.info('initialization failed')
+            return
+        if state == SwitchState.READY:
+            return
+        self._device.change_state(state)
+        if state == SwitchState.CONFIGURED:
+            self._logger.info('configuration complete')
+        else:
+            self._logger.info('configuration failed')
@@ -12,6 +12,10 @@ class DeviceTask:
         self._args: typing.Dict[str, str] = kwargs
         self._hooks: typing.Dict[SwitchState, typing.Any] = dict()
 
+    @property
+    def device(self) -> Device:
+        return self._device
+
     def get_logger(self, name):
         return logging.getLogger('[{}/{}]'.format(name, self._device.id))
 